@@ -0,0 +1,128 @@
+# Типы индекса FAISS для базы знаний
+#
+# flat     - точный поиск по полным векторам float32 (по умолчанию);
+# ivf_flat - векторы разбиты на nlist кластеров, поиск только в nprobe ближайших;
+# ivf_pq   - то же, векторы сжаты произведением квантователей (PQ): в разы меньше памяти;
+# hnsw     - граф HNSW, быстрый поиск без обучения, точность задается efSearch.
+#
+# IVF-индексы обучаются на векторах корпуса. Для небольшого корпуса число
+# кластеров и параметры PQ уменьшаются до значений, на которых обучение
+# корректно, а если данных совсем мало - используется точный индекс.
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+# FAISS требует не меньше 39 точек обучения на центроид
+MIN_POINTS_PER_CENTROID = 39
+# Обучение ведется на выборке не больше 256 точек на центроид
+MAX_POINTS_PER_CENTROID = 256
+# Число бит на подвектор PQ
+PQ_BITS = 8
+# Векторов за один шаг при копировании точного индекса
+COPY_STEP = 65536
+
+
+# ФУНКЦИЯ: строка index_factory для типа индекса
+#   kind   - тип индекса из INDEX_TYPES
+#   n      - число векторов для обучения
+#   dim    - размерность векторов
+#   nlist  - число кластеров IVF
+#   pq_m   - число подвекторов PQ
+#   hnsw_m - число связей вершины графа HNSW
+def factory_string(kind: str, n: int, dim: int, nlist: int = 1024, pq_m: int = 64, hnsw_m: int = 32) -> str:
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Неизвестный тип индекса {kind!r}, допустимы: {', '.join(INDEX_TYPES)}")
+    if kind == 'hnsw':
+        return f'HNSW{hnsw_m},Flat'
+    if kind == 'flat':
+        return 'Flat'
+
+    nlist = min(nlist, n // MIN_POINTS_PER_CENTROID)
+    if nlist < 2:
+        return 'Flat'
+    if kind == 'ivf_flat':
+        return f'IVF{nlist},Flat'
+
+    # PQ обучает 2**PQ_BITS центроидов на каждый подвектор
+    if n < MIN_POINTS_PER_CENTROID * 2 ** PQ_BITS:
+        return f'IVF{nlist},Flat'
+    m = max(d for d in range(1, min(pq_m, dim) + 1) if dim % d == 0)
+    return f'IVF{nlist},PQ{m}x{PQ_BITS}'
+
+
+# ФУНКЦИЯ: создание и обучение пустого индекса
+#   vectors - матрица векторов корпуса (float32), по ним обучается IVF/PQ
+# Возвращает обученный индекс без векторов
+def build_index(kind: str, vectors: np.ndarray, **params):
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(kind, n, dim, **params), faiss.METRIC_L2)
+    if not index.is_trained:
+        ivf = faiss.extract_index_ivf(index)
+        limit = ivf.nlist * MAX_POINTS_PER_CENTROID
+        if n > limit:
+            sample = np.random.default_rng(0).choice(n, limit, replace=False)
+            vectors = vectors[np.sort(sample)]
+        index.train(vectors)
+    return index
+
+
+# ФУНКЦИЯ: параметры поиска
+#   nprobe    - число просматриваемых кластеров IVF
+#   ef_search - ширина поиска в графе HNSW
+def tune_index(index, nprobe: int = None, ef_search: int = None):
+    space = faiss.ParameterSpace()
+    inner = faiss.downcast_index(index)
+    if nprobe and faiss.try_extract_index_ivf(inner) is not None:
+        space.set_index_parameter(index, 'nprobe', nprobe)
+    if ef_search and isinstance(inner, faiss.IndexHNSW):
+        space.set_index_parameter(index, 'efSearch', ef_search)
+
+
+# ФУНКЦИЯ: можно ли удалять векторы из индекса через FAISS.delete из LangChain
+# После удаления LangChain перенумеровывает векторы подряд. Так делает только
+# точный индекс; IVF сохраняет прежние номера, а HNSW удаление не поддерживает,
+# поэтому эти индексы строятся заново
+def supports_remove(index) -> bool:
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+
+
+# ФУНКЦИЯ: описание индекса для статистики
+def describe(index) -> dict:
+    inner = faiss.downcast_index(index)
+    info = {'type': type(inner).__name__, 'vectors': index.ntotal, 'dim': index.d}
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        info.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        info.update(ef_search=inner.hnsw.efSearch)
+    return info
+
+
+# ФУНКЦИЯ: индекс, который FAISS может отобразить в память (IO_FLAG_MMAP)
+# Отображаются только списки IVF. Точный flat-индекс копируется в IVF с одним
+# списком: поиск по нему остается точным, а порядок векторов сохраняется.
+# Возвращает индекс или None, если тип индекса не отображается (HNSW)
+def mmap_index(index):
+    inner = faiss.downcast_index(index)
+    if faiss.try_extract_index_ivf(inner) is not None:
+        return index
+    if not isinstance(inner, faiss.IndexFlat):
+        return None
+
+    quantizer = faiss.IndexFlat(inner.d, inner.metric_type)
+    quantizer.add(np.zeros((1, inner.d), dtype=np.float32))
+    ivf = faiss.IndexIVFFlat(quantizer, inner.d, 1, inner.metric_type)
+    ivf.is_trained = True
+    for start in range(0, inner.ntotal, COPY_STEP):
+        ivf.add(inner.reconstruct_n(start, min(COPY_STEP, inner.ntotal - start)))
+    # квантователь принадлежит IVF-индексу и освобождается вместе с ним
+    quantizer.this.disown()
+    ivf.own_fields = True
+    return ivf
+
+
+# ФУНКЦИЯ: чтение индекса с отображением в память только для чтения
+def read_mmap(path: str):
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
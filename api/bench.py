@@ -0,0 +1,527 @@
+# Нагрузочные замеры API
+#
+# Запуск:
+#   python -m api.bench latency --url http://127.0.0.1:8000 --levels 1,10,50,100,200
+#   python -m api.bench ttft --url http://127.0.0.1:8000
+#   python -m api.bench connections --requests 1000
+#   python -m api.bench ocr --images 100 --size 5
+#   python -m api.bench index --vectors 1000000 --dim 128
+#
+# latency     - задержка /api/get_answer_async при росте числа одновременных клиентов.
+#               Для каждого уровня выводятся p50/p99 и пропускная способность;
+#               при неблокирующем поиске p99 не должен расти вместе с числом клиентов.
+# ttft        - время до первого токена и до полного ответа /api/get_answer_stream.
+# connections - число TCP-соединений, которые Chunk.request открывает к локальной
+#               заглушке OpenAI: общий клиент против клиента на каждый запрос.
+# ocr         - пиковое потребление памяти и пропускная способность Chunk.ocr_image
+#               для N одновременных изображений: общая сессия и сборка тела запроса
+#               без сериализации картинки против сессии и json= на каждый запрос.
+# index       - полнота recall@k и задержка поиска индексов ivf_flat, ivf_pq и hnsw
+#               при разных nprobe/efSearch относительно точного flat на синтетическом
+#               корпусе, а также размер индекса и время построения.
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import statistics
+import time
+import tracemalloc
+
+import aiohttp
+import orjson
+
+QUESTIONS = [
+    'Какие исключения предусмотрены в страховом договоре?',
+    'Что считается страховым случаем?',
+    'Как расторгнуть договор страхования?',
+    'В какой срок выплачивается страховое возмещение?',
+]
+
+
+# Минимальный HTTP/1.1-сервер, имитирующий OpenAI API.
+# Поддерживает keep-alive и считает принятые TCP-соединения и запросы.
+class StubServer:
+    def __init__(self, delay: float = 0.0, token_delay: float = 0.05):
+        self.delay = delay
+        self.token_delay = token_delay
+        self.streamed = 0
+        self.connections = 0
+        self.requests = 0
+        self.bytes = 0
+        self.embedded = 0
+        self.server = None
+        self.port = None
+        self.writers = set()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/v1'
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        # закрываем keep-alive соединения, которые клиенты оставили открытыми
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    # ответ на запрос: эмбеддинги (детерминированные псевдослучайные векторы) или chat/completions
+    def completion(self, path: str, body: bytes) -> bytes:
+        if path.endswith('/embeddings'):
+            inputs = orjson.loads(body)['input']
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            self.embedded += len(inputs)
+            return orjson.dumps({
+                'object': 'list',
+                'model': 'stub',
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': self.vector(item)}
+                    for i, item in enumerate(inputs)
+                ],
+                'usage': {'prompt_tokens': 1, 'total_tokens': 1}
+            })
+        return orjson.dumps({
+            'id': 'stub',
+            'object': 'chat.completion',
+            'created': 0,
+            'model': 'stub',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': 'ok'},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        })
+
+    # потоковый ответ chat/completions: несколько SSE-событий с паузой между ними
+    async def stream(self, writer, tokens: int = 5):
+        writer.write(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream\r\n'
+            b'Transfer-Encoding: chunked\r\n\r\n'
+        )
+        for i in range(tokens + 1):
+            delta = {'content': f'token{i} '} if i < tokens else {}
+            event = b'data: ' + orjson.dumps({
+                'id': 'stub',
+                'object': 'chat.completion.chunk',
+                'created': 0,
+                'model': 'stub',
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if delta else 'stop'}]
+            }) + b'\n\n'
+            if i == tokens:
+                event += b'data: [DONE]\n\n'
+            writer.write(f'{len(event):x}\r\n'.encode('latin-1') + event + b'\r\n')
+            await writer.drain()
+            self.streamed += 1
+            await asyncio.sleep(self.token_delay)
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    @staticmethod
+    def vector(item, dim: int = 64) -> list:
+        seed = hashlib.sha256(orjson.dumps(item)).digest()
+        return [(b - 127.5) / 127.5 for b in (seed * (dim // len(seed) + 1))[:dim]]
+
+    async def read_body(self, reader, headers: dict) -> bytes:
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b''.join(parts)
+                parts.append(await reader.readexactly(size))
+                await reader.readline()
+        return await reader.readexactly(int(headers.get('content-length', 0)))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                path = lines[0].split(' ')[1]
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await self.read_body(reader, headers)
+                self.requests += 1
+                self.bytes += len(body)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if path.endswith('/chat/completions') and orjson.loads(body).get('stream'):
+                    await self.stream(writer)
+                    continue
+                payload = self.completion(path, body)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\n'
+                    b'Content-Type: application/json\r\n'
+                    b'x-ratelimit-limit-requests: 10000\r\n'
+                    b'x-ratelimit-limit-tokens: 1000000\r\n'
+                    b'x-ratelimit-remaining-requests: 9999\r\n'
+                    b'x-ratelimit-remaining-tokens: 999999\r\n'
+                    b'x-ratelimit-reset-requests: 6ms\r\n'
+                    b'x-ratelimit-reset-tokens: 0s\r\n'
+                    + f'Content-Length: {len(payload)}\r\n\r\n'.encode('latin-1')
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+# ФУНКЦИЯ: объект Chunk, направленный на заглушку OpenAI
+def stub_chunk(stub: StubServer):
+    os.environ['OPENAI_API_BASE'] = stub.url
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    # лимиты заглушки совпадают с ее заголовками x-ratelimit-*
+    os.environ.setdefault('OPENAI_RPM', '10000')
+    os.environ.setdefault('OPENAI_TPM', '1000000')
+    from api import chunks
+    # адрес OCR вычисляется при импорте chunks: у каждой заглушки свой порт
+    chunks.OCR_URL = f'{stub.url}/chat/completions'
+    return chunks.Chunk()
+
+
+# ФУНКЦИЯ: перцентиль по отсортированному списку
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+# ФУНКЦИЯ: один уровень нагрузки
+#   clients  - число одновременных клиентов
+#   requests - общее число запросов на уровне
+# Возвращает словарь с метриками
+async def run_level(session, url: str, clients: int, requests: int) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in counter:
+            param = {'text': QUESTIONS[i % len(QUESTIONS)]}
+            start = time.perf_counter()
+            try:
+                async with session.post(f'{url}/api/get_answer_async', json=param) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'clients': clients,
+        'ok': len(latencies),
+        'errors': errors,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'mean': statistics.fmean(latencies) if latencies else 0.0,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+async def latency(args):
+    levels = [int(x) for x in args.levels.split(',')]
+    connector = aiohttp.TCPConnector(limit=max(levels))
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        print(f'{"clients":>8} {"ok":>6} {"err":>5} {"p50, c":>8} {"p99, c":>8} {"rps":>8}')
+        for clients in levels:
+            requests = max(args.requests, clients)
+            row = await run_level(session, args.url.rstrip('/'), clients, requests)
+            print(f'{row["clients"]:>8} {row["ok"]:>6} {row["errors"]:>5} '
+                  f'{row["p50"]:>8.3f} {row["p99"]:>8.3f} {row["rps"]:>8.1f}')
+
+
+async def ttft(args):
+    url = args.url.rstrip('/')
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    first, total = [], []
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for i in range(args.requests):
+            param = {'text': QUESTIONS[i % len(QUESTIONS)]}
+            start = time.perf_counter()
+            async with session.post(f'{url}/api/get_answer_stream', json=param) as response:
+                got_first = False
+                async for line in response.content:
+                    if not got_first and line.startswith(b'data: '):
+                        first.append(time.perf_counter() - start)
+                        got_first = True
+            total.append(time.perf_counter() - start)
+    first.sort()
+    total.sort()
+    print(f'первый токен: p50 {percentile(first, 50):.3f} c, p99 {percentile(first, 99):.3f} c')
+    print(f'полный ответ: p50 {percentile(total, 50):.3f} c, p99 {percentile(total, 99):.3f} c')
+
+
+async def connections(args):
+    from langchain_openai import ChatOpenAI
+    from langchain.schema import HumanMessage
+
+    for mode in args.modes.split(','):
+        stub = StubServer(delay=args.delay)
+        await stub.start()
+        chunk = stub_chunk(stub)
+        chunk.open()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            async with semaphore:
+                if mode == 'shared':
+                    return await chunk.request('', f'ping {i}', temp=0)
+                # прежнее поведение: новый клиент на каждый запрос
+                chat = ChatOpenAI(model_name='gpt-4', temperature=0, openai_api_key='stub')
+                response = await chat.agenerate([[HumanMessage(content=f'ping {i}')]])
+                return response.generations[0][0].text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        await chunk.close()
+        await stub.stop()
+        print(f'{mode:>12}: запросов {stub.requests}, TCP-соединений {stub.connections}, '
+              f'{stub.requests / elapsed:.0f} запросов/с')
+
+
+async def ocr(args):
+    # одна и та же картинка для всех запросов: в замер попадают только копии,
+    # которые делает путь отправки, а не сами входные данные
+    image = base64.b64encode(os.urandom(int(args.size * 1024 * 1024 * 3 / 4))).decode('ascii')
+    text = 'Распознай текст на изображении'
+
+    for mode in args.modes.split(','):
+        stub = StubServer()
+        await stub.start()
+        chunk = stub_chunk(stub)
+        chunk.open()
+
+        async def legacy():
+            # прежний путь: новая сессия и сериализация всего словаря на каждый запрос
+            payload = {
+                'model': 'gpt-4o-mini',
+                'messages': [{'role': 'user', 'content': [
+                    {'type': 'text', 'text': text},
+                    {'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64, {image}'}}
+                ]}]
+            }
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f'{stub.url}/chat/completions', json=payload) as response:
+                    return (await response.json())['choices'][0]['message']['content']
+
+        async def one():
+            if mode == 'shared':
+                return await chunk.ocr_image({'image': image, 'text': text})
+            return await legacy()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.images)))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        await chunk.close()
+        await stub.stop()
+        print(f'{mode:>8}: изображений {stub.requests}, TCP-соединений {stub.connections}, '
+              f'пик памяти {peak / 2**20:.0f} МБ, {stub.requests / elapsed:.1f} изображений/с, '
+              f'{stub.bytes / elapsed / 2**20:.0f} МБ/с')
+
+
+# ФУНКЦИЯ: синтетический корпус - векторы вокруг случайных центров кластеров
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int = 0):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    step = 100000
+    for start in range(0, n, step):
+        size = min(step, n - start)
+        labels = rng.integers(0, clusters, size)
+        vectors[start:start + size] = centers[labels] + 0.5 * rng.standard_normal((size, dim), dtype=np.float32)
+    return vectors
+
+
+async def index(args):
+    import faiss
+    import numpy as np
+    from api.ann import build_index, describe, tune_index
+
+    vectors = synthetic_vectors(args.vectors + args.queries, args.dim, args.clusters)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    print(f'корпус {len(vectors)} x {args.dim}, запросов {len(queries)}, k={args.k}')
+
+    # точные соседи по flat
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    def measure(index, name):
+        latencies, found = [], 0
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, ids = index.search(queries[i:i + 1], args.k)
+            latencies.append(time.perf_counter() - start)
+            found += len(np.intersect1d(ids[0], truth[i]))
+        latencies.sort()
+        print(f'{name:>28}: recall@{args.k} {found / truth.size:.3f}, '
+              f'p50 {percentile(latencies, 50) * 1000:.3f} мс, p99 {percentile(latencies, 99) * 1000:.3f} мс')
+
+    size = exact.ntotal * args.dim * 4
+    print(f'{"flat":>10}: {size / 2**20:.0f} МБ')
+    measure(exact, 'flat')
+    del exact
+
+    params = dict(nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+    for kind in args.types.split(','):
+        start = time.perf_counter()
+        built = build_index(kind, vectors, **params)
+        built.add(vectors)
+        elapsed = time.perf_counter() - start
+        size = faiss.serialize_index(built).nbytes
+        print(f'{kind:>10}: {describe(built)}, {size / 2**20:.0f} МБ, построение {elapsed:.1f} с')
+        levels = args.ef_search if kind == 'hnsw' else args.nprobe
+        for level in (int(level) for level in levels.split(',')):
+            if kind == 'hnsw':
+                tune_index(built, ef_search=level)
+                measure(built, f'{kind} efSearch={level}')
+            else:
+                tune_index(built, nprobe=level)
+                measure(built, f'{kind} nprobe={level}')
+        del built
+
+
+# ФУНКЦИЯ: проверка удаления документа из индекса
+# Как при обновлении базы знаний: документ удаляется из индекса (db.delete), если тип
+# индекса это поддерживает, иначе индекс строится заново. Затем добавляется новый
+# документ, и каждый оставшийся чанк ищется по своему вектору: номер вектора в индексе
+# должен указывать на тот же чанк в docstore.
+async def remove(args):
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+    from api.ann import build_index, supports_remove, tune_index
+
+    total = (args.documents + 1) * args.chunks
+    vectors = synthetic_vectors(total, args.dim, args.clusters)
+    ids = [f'doc{i // args.chunks}:{i % args.chunks}' for i in range(total)]
+    # последний документ добавляется после удаления первого
+    count = args.documents * args.chunks
+    removed = set(ids[:args.chunks])
+    failed = False
+
+    def store(kind, rows):
+        index = build_index(kind, vectors[rows], nlist=args.nlist)
+        # полный просмотр: промахи поиска не должны маскировать ошибки нумерации
+        tune_index(index, nprobe=args.nlist, ef_search=max(256, 2 * len(rows)))
+        db = FAISS(FakeEmbeddings(size=args.dim), index, InMemoryDocstore(), {})
+        db.add_embeddings([(ids[i], vectors[i]) for i in rows], ids=[ids[i] for i in rows])
+        return db
+
+    for kind in args.types.split(','):
+        db = store(kind, list(range(count)))
+        if supports_remove(db.index):
+            db.delete(list(removed))
+            mode = 'удаление'
+        else:
+            db = store(kind, list(range(args.chunks, count)))
+            mode = 'перестроение'
+        db.add_embeddings([(ids[i], vectors[i]) for i in range(count, total)], ids=ids[count:])
+
+        rows = list(range(args.chunks, total))
+        _, labels = db.index.search(vectors[rows], 1)
+        wrong = 0
+        for i, label in zip(rows, labels[:, 0]):
+            doc_id = db.index_to_docstore_id.get(int(label))
+            if doc_id != ids[i] or db.docstore.search(doc_id).page_content != ids[i]:
+                wrong += 1
+        consistent = db.index.ntotal == len(db.index_to_docstore_id) == len(rows)
+        failed |= wrong > 0 or not consistent
+        print(f'{kind:>10}: {mode}, векторов {db.index.ntotal}, в docstore {len(db.index_to_docstore_id)}, '
+              f'неверных самопоисков {wrong} из {len(rows)}')
+    if failed:
+        raise SystemExit('Нумерация индекса и docstore расходится после удаления')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочные замеры API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_latency = commands.add_parser('latency', help='задержка /api/get_answer_async')
+    parser_latency.add_argument('--url', default='http://127.0.0.1:8000')
+    parser_latency.add_argument('--levels', default='1,10,50,100,200')
+    parser_latency.add_argument('--requests', type=int, default=400, help='запросов на уровень')
+    parser_latency.add_argument('--timeout', type=float, default=120)
+    parser_latency.set_defaults(handler=latency)
+
+    parser_ttft = commands.add_parser('ttft', help='время до первого токена /api/get_answer_stream')
+    parser_ttft.add_argument('--url', default='http://127.0.0.1:8000')
+    parser_ttft.add_argument('--requests', type=int, default=20)
+    parser_ttft.add_argument('--timeout', type=float, default=120)
+    parser_ttft.set_defaults(handler=ttft)
+
+    parser_connections = commands.add_parser('connections', help='TCP-соединения к OpenAI')
+    parser_connections.add_argument('--requests', type=int, default=1000)
+    parser_connections.add_argument('--concurrency', type=int, default=50)
+    parser_connections.add_argument('--modes', default='shared,per-request')
+    parser_connections.add_argument('--delay', type=float, default=0.0, help='задержка ответа заглушки, с')
+    parser_connections.set_defaults(handler=connections)
+
+    parser_ocr = commands.add_parser('ocr', help='память и пропускная способность распознавания')
+    parser_ocr.add_argument('--images', type=int, default=100)
+    parser_ocr.add_argument('--size', type=float, default=5, help='размер изображения, МБ')
+    parser_ocr.add_argument('--modes', default='shared,legacy')
+    parser_ocr.set_defaults(handler=ocr)
+
+    parser_index = commands.add_parser('index', help='recall@k и задержка индексов FAISS')
+    parser_index.add_argument('--vectors', type=int, default=1000000)
+    parser_index.add_argument('--dim', type=int, default=128, help='размерность (у ada-002 - 1536)')
+    parser_index.add_argument('--clusters', type=int, default=1000, help='кластеров в синтетическом корпусе')
+    parser_index.add_argument('--queries', type=int, default=1000)
+    parser_index.add_argument('--k', type=int, default=10)
+    parser_index.add_argument('--types', default='ivf_flat,ivf_pq,hnsw')
+    parser_index.add_argument('--nlist', type=int, default=4096)
+    parser_index.add_argument('--pq-m', type=int, default=32)
+    parser_index.add_argument('--hnsw-m', type=int, default=32)
+    parser_index.add_argument('--nprobe', default='1,8,32,128')
+    parser_index.add_argument('--ef-search', default='16,64,256')
+    parser_index.set_defaults(handler=index)
+
+    parser_remove = commands.add_parser('remove', help='поиск после удаления документа из индекса')
+    parser_remove.add_argument('--documents', type=int, default=50)
+    parser_remove.add_argument('--chunks', type=int, default=40, help='чанков в документе')
+    parser_remove.add_argument('--dim', type=int, default=64)
+    parser_remove.add_argument('--clusters', type=int, default=20)
+    parser_remove.add_argument('--nlist', type=int, default=16)
+    parser_remove.add_argument('--types', default='flat,ivf_flat,hnsw')
+    parser_remove.set_defaults(handler=remove)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
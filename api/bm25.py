@@ -0,0 +1,139 @@
+# Лексический поиск по базе знаний (BM25)
+#
+# Дополняет векторный поиск FAISS там, где важны точные слова: номера пунктов
+# правил ("п. 4.2"), юридические термины, редкие названия. Индекс строится
+# в памяти по тем же фрагментам, что и FAISS, и хранит для каждого терма
+# массивы номеров фрагментов и частот, так что оценка запроса - несколько
+# векторных операций NumPy на терм запроса.
+#
+# Результаты лексического и векторного поиска объединяются методом
+# reciprocal rank fusion (RRF).
+
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Слова и номера пунктов ("4", "4.2", "4.2.1")
+TOKEN_RE = re.compile(r'\d+(?:\.\d+)*|[a-zа-я]+')
+
+# Заголовок пункта в тексте правил: строка начинается с "4.2." или "4.2.1."
+HEADING_RE = re.compile(r'^\s*(\d+(?:\.\d+)+)\.?\s', re.M)
+
+# Ссылка на пункт в вопросе: "п. 4.2", "пп 4.2.1", "пункт 4.2", "раздел 4"
+CLAUSE_RE = re.compile(r'(?:\bп{1,2}\.?|\bпункт\w*|\bподпункт\w*|\bраздел\w*|§)\s*(\d+(?:\.\d+)*)')
+
+# Окончания для упрощенного стемминга, от длинных к коротким
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иях', 'ией', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ых', 'их', 'ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ей', 'ия', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+# Служебные слова, которые не влияют на релевантность
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'не', 'на', 'с', 'со', 'по', 'к', 'ко', 'о', 'об', 'от', 'до', 'из',
+    'за', 'для', 'при', 'или', 'а', 'но', 'же', 'ли', 'бы', 'то', 'как', 'что', 'это',
+    'так', 'у', 'без', 'под', 'над', 'если', 'чем', 'его', 'ее', 'их', 'также', 'который',
+    'которые', 'которых', 'какой', 'какие', 'ли', 'мне', 'я', 'вы', 'мы',
+))
+
+# Минимальная длина основы после отбрасывания окончания
+MIN_STEM = 4
+
+
+# ФУНКЦИЯ: упрощенный стемминг русского слова
+def stem(word: str) -> str:
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+# ФУНКЦИЯ: разбиение текста на термы
+# Регистр и "ё" нормализуются, номера пунктов сохраняются целиком
+def tokenize(text: str) -> list:
+    text = text.lower().replace('ё', 'е')
+    return [
+        token if token[0].isdigit() else stem(token)
+        for token in TOKEN_RE.findall(text)
+        if token not in STOP_WORDS
+    ]
+
+
+# ФУНКЦИЯ: номера пунктов, на которые ссылается вопрос
+def clause_refs(query: str) -> list:
+    return [ref.rstrip('.') for ref in CLAUSE_RE.findall(query.lower())]
+
+
+# ФУНКЦИЯ: объединение ранжированных списков (reciprocal rank fusion)
+#   rankings - списки номеров фрагментов, лучшие первыми
+#   k        - сглаживающая константа RRF
+# Возвращает номера фрагментов по убыванию суммарной оценки
+def rrf(rankings, k: int = 60) -> list:
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    def __init__(self, texts, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.size = len(texts)
+
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(self.size, dtype=np.float32)
+        # номер пункта -> фрагменты, где начинается этот пункт
+        self.clauses = defaultdict(list)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                docs, freqs = postings[term]
+                docs.append(doc)
+                freqs.append(tf)
+            for clause in HEADING_RE.findall(text):
+                if doc not in self.clauses[clause]:
+                    self.clauses[clause].append(doc)
+
+        # терм -> (номера фрагментов, частоты, idf)
+        self.terms = {}
+        for term, (docs, freqs) in postings.items():
+            df = len(docs)
+            idf = np.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            self.terms[term] = (np.array(docs, dtype=np.int32), np.array(freqs, dtype=np.float32), idf)
+
+        # знаменатель BM25 без частоты терма: k1 * (1 - b + b * |d| / avgdl)
+        average = lengths.mean() if self.size else 0.0
+        self.norm = k1 * (1 - b + b * lengths / average) if average else np.full(self.size, k1)
+
+    # МЕТОД: поиск по BM25
+    # Возвращает номера фрагментов по убыванию оценки (только с ненулевой оценкой)
+    def search(self, query: str, k: int = 10) -> list:
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.terms.get(term)
+            if posting is None:
+                continue
+            docs, freqs, idf = posting
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self.norm[docs])
+
+        found = np.flatnonzero(scores)
+        if len(found) > k:
+            found = found[np.argpartition(-scores[found], k - 1)[:k]]
+        return [int(doc) for doc in found[np.argsort(-scores[found], kind='stable')]]
+
+    # МЕТОД: фрагменты с пунктами, на которые ссылается вопрос
+    # На "п. 4.2" находятся пункт 4.2 и его подпункты 4.2.1, 4.2.2 и т. д.
+    # Возвращает номера фрагментов в порядке текста правил (пустой список, если ссылок нет)
+    def clause_docs(self, query: str) -> list:
+        found = []
+        for ref in clause_refs(query):
+            prefix = ref + '.'
+            for clause, docs in self.clauses.items():
+                if clause == ref or clause.startswith(prefix):
+                    found.extend(doc for doc in docs if doc not in found)
+        return sorted(found)
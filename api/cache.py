@@ -0,0 +1,132 @@
+# Кэш ответов на вопросы к базе знаний
+#
+# Первый уровень - точное совпадение нормализованного вопроса (LRU).
+# Второй уровень - семантический: эмбеддинг вопроса сравнивается с эмбеддингами
+# уже отвеченных вопросов, и при косинусной близости выше порога
+# возвращается сохраненный ответ.
+# Оба уровня ограничены по размеру и времени жизни записей и сбрасываются
+# при смене версии базы знаний.
+
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ФУНКЦИЯ: нормализация вопроса для точного совпадения
+def normalize(text: str) -> str:
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'[^\w\s.]', ' ', text)
+    return ' '.join(text.split()).strip(' .')
+
+
+class AnswerCache:
+    def __init__(self, size: int = 1000, ttl: float = 3600,
+                 semantic_size: int = 1000, threshold: float = 0.95):
+        self.size = size
+        self.ttl = ttl
+        self.semantic_size = semantic_size
+        self.threshold = threshold
+        self.version = None
+
+        # точное совпадение: ключ -> (время истечения, ответ)
+        self.exact = OrderedDict()
+
+        # семантический уровень: матрица нормированных векторов и данные строк
+        self.vectors = None
+        self.expires = np.zeros(semantic_size)
+        self.used = np.zeros(semantic_size)
+        self.answers = [None] * semantic_size
+        self.count = 0
+
+        # счетчики попаданий и промахов
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    # МЕТОД: сброс кэша при смене версии базы знаний
+    #   version - ключ индекса, по которому построены ответы
+    def reset(self, version: str = None):
+        if version is not None and version == self.version:
+            return
+        self.version = version
+        self.exact.clear()
+        self.vectors = None
+        self.answers = [None] * self.semantic_size
+        self.count = 0
+
+    # МЕТОД: поиск по точному совпадению
+    def get(self, key: str):
+        item = self.exact.get(key)
+        if item is not None:
+            expires, answer = item
+            if expires > time.monotonic():
+                self.exact.move_to_end(key)
+                self.hits_exact += 1
+                return answer
+            del self.exact[key]
+        return None
+
+    # МЕТОД: поиск по близости эмбеддинга
+    #   vector - эмбеддинг вопроса
+    def get_similar(self, vector):
+        if self.count:
+            query = self._unit(vector)
+            now = time.monotonic()
+            scores = self.vectors[:self.count] @ query
+            scores[self.expires[:self.count] <= now] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.used[best] = now
+                self.hits_semantic += 1
+                return self.answers[best]
+        self.misses += 1
+        return None
+
+    # МЕТОД: сохранение ответа в оба уровня кэша
+    def put(self, key: str, answer: str, vector=None):
+        now = time.monotonic()
+        # повторный ответ на тот же вопрос не занимает новую строку семантического уровня
+        if key in self.exact:
+            vector = None
+        self.exact[key] = (now + self.ttl, answer)
+        self.exact.move_to_end(key)
+        while len(self.exact) > self.size:
+            self.exact.popitem(last=False)
+
+        if vector is None or not self.semantic_size:
+            return
+        vector = self._unit(vector)
+        if self.vectors is None:
+            self.vectors = np.zeros((self.semantic_size, len(vector)), dtype=np.float32)
+        if self.count < self.semantic_size:
+            row = self.count
+            self.count += 1
+        else:
+            # вытесняем просроченную или дольше всех не использованную запись
+            expired = np.flatnonzero(self.expires <= now)
+            row = int(expired[0]) if len(expired) else int(np.argmin(self.used))
+        self.vectors[row] = vector
+        self.expires[row] = now + self.ttl
+        self.used[row] = now
+        self.answers[row] = answer
+
+    # МЕТОД: статистика кэша
+    def stats(self) -> dict:
+        total = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            'version': self.version,
+            'exact_size': len(self.exact),
+            'semantic_size': self.count,
+            'hits_exact': self.hits_exact,
+            'hits_semantic': self.hits_semantic,
+            'misses': self.misses,
+            'hit_rate': (self.hits_exact + self.hits_semantic) / total if total else 0.0,
+        }
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -2,47 +2,156 @@ from dotenv import load_dotenv
 import os
 import openai
 import asyncio
-import aiofiles
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+import base64
+import time
+import weakref
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 import aiohttp
-import time
 import json
+import re
+import orjson
+import numpy as np
+import importlib.util
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
+from PIL import Image
+from api.index_store import IndexStore, INDEX_DIR, index_key, manifest_version
+from api.ingest import Ingestor, file_hash, list_documents, train_size
+from api.embeddings import CachedEmbeddings
+from api.limiter import RateLimits
+from api.tokens import COMPLETION_RESERVE, assemble_context, count_messages, count_tokens
+from api.images import OcrCache, prepare_image
+from api.singleflight import SingleFlight
+from api.cache import AnswerCache, normalize
+from api.bm25 import BM25Index, rrf
+from api.ann import build_index, tune_index
+from api.knowledge import Knowledge, base_signature, memory
 
 # Загрузка переменных окружения
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+# Настройки базы знаний (любое изменение приводит к перестроению индекса)
+# Каталог с документами базы знаний и шаблоны имен файлов
+BASE_DIR = os.getenv('BASE_DIR', os.path.join(os.path.dirname(__file__), 'base'))
+BASE_PATTERNS = ('*.txt', '*.md')
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 0
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+
+# Число потоков для поиска по FAISS (FAISS отпускает GIL во время поиска)
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', os.cpu_count() or 4))
+# Тип индекса FAISS (flat, ivf_flat, ivf_pq, hnsw) и его параметры
+INDEX_TYPE = os.getenv('INDEX_TYPE', 'flat')
+INDEX_NLIST = int(os.getenv('INDEX_NLIST', '1024'))
+INDEX_PQ_M = int(os.getenv('INDEX_PQ_M', '64'))
+INDEX_HNSW_M = int(os.getenv('INDEX_HNSW_M', '32'))
+# Параметры поиска: кластеров IVF и ширина поиска HNSW
+INDEX_NPROBE = int(os.getenv('INDEX_NPROBE', '16'))
+INDEX_EF_SEARCH = int(os.getenv('INDEX_EF_SEARCH', '64'))
+# Процессов для разбиения документов при обновлении индекса (0 - без пула процессов)
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0'))
+# Индекс отображается в память только для чтения (режим нескольких воркеров, см. api/serve.py)
+INDEX_MMAP = os.getenv('INDEX_MMAP', '0') == '1'
+
+# Кэш эмбеддингов: размер в памяти и на диске, окно и размер микробатча
+EMBEDDING_CACHE_PATH = os.path.join(INDEX_DIR, 'embeddings.sqlite')
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_DISK_CACHE_SIZE = int(os.getenv('EMBEDDING_DISK_CACHE_SIZE', '200000'))
+EMBEDDING_BATCH_WINDOW = float(os.getenv('EMBEDDING_BATCH_WINDOW', '0.005'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+
+# Кэш ответов: размер, время жизни (с) и порог косинусной близости
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+
+# Лимиты OpenAI по умолчанию (уточняются по заголовкам ответов).
+# RATE_LIMIT_PATH - файл SQLite для общих лимитов нескольких воркеров
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', '500'))
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', '30000'))
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH') or None
+
+# Модель и оценка токенов для распознавания изображений
+OCR_MODEL = 'gpt-4o-mini'
+OCR_IMAGE_TOKENS = int(os.getenv('OCR_IMAGE_TOKENS', '1500'))
+OCR_URL = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1').rstrip('/') + '/chat/completions'
+# Пул соединений aiohttp для распознавания изображений
+OCR_MAX_CONNECTIONS = int(os.getenv('OCR_MAX_CONNECTIONS', '100'))
+OCR_MAX_CONNECTIONS_PER_HOST = int(os.getenv('OCR_MAX_CONNECTIONS_PER_HOST', '50'))
+
+# Подготовка изображений: длинная сторона (px), качество JPEG
+OCR_MAX_EDGE = int(os.getenv('OCR_MAX_EDGE', '1536'))
+OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', '85'))
+# Кэш распознавания: размер, время жизни (с), допуск перцептивного хэша (бит)
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '1000'))
+OCR_CACHE_TTL = float(os.getenv('OCR_CACHE_TTL', '86400'))
+OCR_HASH_DISTANCE = int(os.getenv('OCR_HASH_DISTANCE', '4'))
+
+# Метка, на место которой в тело запроса подставляется картинка
+IMAGE_PLACEHOLDER = '@@IMAGE_BASE64@@'
+BASE64_RE = re.compile(rb'[A-Za-z0-9+/]*={0,2}')
+
+# Контекст ответа: сколько фрагментов искать и бюджет токенов на них
+CONTEXT_K = int(os.getenv('CONTEXT_K', '6'))
+CONTEXT_TOKENS = int(os.getenv('CONTEXT_TOKENS', '1500'))
+# Гибридный поиск: кандидатов от каждого поиска и константа объединения RRF
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+
+# Ответ, если в базе знаний ничего не найдено
+NOT_FOUND = "Извините, я не смог найти информацию для ответа на ваш вопрос."
+# Расход токенов, когда модель не вызывалась
+NO_USAGE = {'prompt_tokens': 0, 'completion_tokens': 0}
+
+# Пул соединений к OpenAI: общий для всех запросов процесса
+LLM_MODEL = 'gpt-4'
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+# HTTP/2 включается, только если установлен пакет h2
+LLM_HTTP2 = importlib.util.find_spec('h2') is not None
+
+# ФУНКЦИЯ: ключ настроек индекса: разбиение на чанки, модель эмбеддингов, тип индекса
+def settings_key() -> str:
+    return index_key(b'', {
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP,
+        'model': EMBEDDING_MODEL,
+        'index': INDEX_TYPE,
+        'nlist': INDEX_NLIST,
+        'pq_m': INDEX_PQ_M,
+        'hnsw_m': INDEX_HNSW_M
+    })
+
 class Chunk:
     def __init__(self):
         # Установка API-ключа
         openai.api_key = os.getenv("OPENAI_API_KEY")
         if not openai.api_key:
             raise ValueError("Ключ API OpenAI не найден. Проверьте переменные окружения.")
-        # Инициализация асинхронной загрузки базы данных
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.base_load())
-
-    async def base_load(self):
-        # Чтение базы знаний
-        rules_path = os.path.join(os.path.dirname(__file__), 'base', 'Rules.txt')
-        if not os.path.exists(rules_path):
-            raise FileNotFoundError(f"Файл {rules_path} не найден.")
-        
-        async with aiofiles.open(rules_path, 'r', encoding='utf-8') as file:
-            document = await file.read()
-
-        # Разбиение текста на чанки
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-        source_chunks = splitter.split_text(document)
-        docs = [Document(page_content=chunk) for chunk in source_chunks]
-
-        # Создание векторной базы
-        embeddings = OpenAIEmbeddings(openai_api_key=openai.api_key)
-        self.db = FAISS.from_documents(docs, embeddings)
+        # Хранилище индекса на диске
+        self.store = IndexStore()
+        # Состояние базы знаний: событие готовности и ошибка загрузки
+        self.embeddings = None
+        # Текущий снимок базы знаний (подменяется целиком при перезагрузке)
+        self.knowledge = None
+        # Все живые снимки: старый остается, пока его используют запросы
+        self.snapshots = weakref.WeakSet()
+        # Перезагрузки выполняются по одной: в памяти не больше двух снимков сразу
+        self.reload_lock = asyncio.Lock()
+        self.reloads = {'count': 0, 'duration': None, 'error': None, 'memory_before': None, 'memory_after': None}
+        # HTTP-клиенты и клиенты ChatOpenAI создаются при старте приложения (open)
+        self.http_client = None
+        self.session = None
+        self.chats = {}
+        self.ready = asyncio.Event()
+        self.error = None
 
         # Формирование системного сообщения
         self.system = '''
@@ -52,13 +161,346 @@ class Chunk:
             Не упоминай документ с информацией в ответах.
         '''
 
-    async def get_answer(self, query: str):
+        # Кэш ответов (сбрасывается при смене индекса)
+        self.cache = AnswerCache(
+            size=ANSWER_CACHE_SIZE,
+            ttl=ANSWER_CACHE_TTL,
+            semantic_size=SEMANTIC_CACHE_SIZE,
+            threshold=SEMANTIC_CACHE_THRESHOLD
+        )
+
+        # Кэш распознанных изображений
+        self.ocr_cache = OcrCache(size=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL, distance=OCR_HASH_DISTANCE)
+
+        # Объединение одинаковых одновременных запросов к модели
+        self.flights = SingleFlight()
+
+        # Ограничители скорости, общие для get_answer, request и ocr_image
+        self.limits = RateLimits(rpm=OPENAI_RPM, tpm=OPENAI_TPM, path=RATE_LIMIT_PATH)
+
+        # Пул потоков для поиска, чтобы не блокировать цикл событий
+        self.search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='faiss')
+
+    # МЕТОД: запуск базы знаний
+    # Вызывается из lifespan приложения. Ошибка загрузки не теряется,
+    # а сохраняется в self.error и отдается запросам и /readyz.
+    async def start(self):
+        try:
+            async with self.reload_lock:
+                self.swap(await self.base_load())
+        except Exception as e:
+            self.error = e
+            print(f'Ошибка загрузки базы знаний: {e!r}')
+            raise
+
+    # МЕТОД: подмена снимка базы знаний
+    # Ответы, полученные по другой версии базы, больше не действительны
+    def swap(self, knowledge):
+        self.knowledge = knowledge
+        self.snapshots.add(knowledge)
+        self.cache.reset(knowledge.version)
+        self.error = None
+        self.ready.set()
+
+    # МЕТОД: перезагрузка базы знаний без остановки сервиса
+    # Новый снимок строится в фоне, старый тем временем продолжает отвечать.
+    # Ошибка перезагрузки не трогает рабочий снимок.
+    # Возвращает статистику перезагрузок
+    async def reload(self):
+        async with self.reload_lock:
+            started = time.monotonic()
+            before = memory()
+            try:
+                knowledge = await self.base_load()
+            except Exception as e:
+                self.reloads['error'] = repr(e)
+                print(f'Ошибка перезагрузки базы знаний: {e!r}')
+                raise
+            if knowledge is not self.knowledge:
+                self.swap(knowledge)
+                print(f'База знаний перезагружена: версия {knowledge.version}')
+            self.reloads.update(
+                count=self.reloads['count'] + 1,
+                duration=round(time.monotonic() - started, 3),
+                error=None,
+                memory_before=before,
+                memory_after=memory()
+            )
+        return self.reload_stats()
+
+    # МЕТОД: отслеживание изменений в каталоге базы знаний
+    #   interval - период опроса в секундах
+    # Подпись каталога запоминается только после успешной перезагрузки: если загрузка
+    # при старте или перезагрузка не удалась, попытка повторяется каждые interval секунд
+    async def watch(self, interval: float):
+        loaded = await asyncio.to_thread(base_signature, BASE_DIR, BASE_PATTERNS)
+        while True:
+            await asyncio.sleep(interval)
+            current = await asyncio.to_thread(base_signature, BASE_DIR, BASE_PATTERNS)
+            failed = self.error is not None or self.reloads['error'] is not None
+            if current == loaded and not failed:
+                continue
+            try:
+                await self.reload()
+            except Exception as e:
+                # работает прежний снимок (или база пуста, если не загрузилась при старте)
+                print(f'Перезагрузка базы знаний не удалась: {e!r}, повтор через {interval:g} с')
+                continue
+            loaded = current
+
+    # МЕТОД: статистика перезагрузок и памяти
+    def reload_stats(self) -> dict:
+        return dict(
+            self.reloads,
+            version=self.knowledge.version if self.knowledge else None,
+            snapshots=len(self.snapshots),
+            memory=memory()
+        )
+
+    # Индекс FAISS текущего снимка
+    @property
+    def db(self):
+        return self.knowledge.db if self.knowledge else None
+
+    # МЕТОД: ожидание готовности базы знаний
+    #   timeout - максимальное время ожидания в секундах (0 - не ждать)
+    # Возвращает True, если база готова
+    async def wait_ready(self, timeout: float) -> bool:
+        if self.error is None and not self.ready.is_set() and timeout > 0:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.error is None and self.ready.is_set()
+
+    # МЕТОД: создание общего HTTP-клиента с пулом keep-alive соединений
+    def open(self):
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(
+                http2=LLM_HTTP2,
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                )
+            )
+
+    # МЕТОД: общая сессия aiohttp для распознавания изображений
+    # Создается при первом обращении внутри цикла событий
+    def ocr_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=OCR_MAX_CONNECTIONS,
+                    limit_per_host=OCR_MAX_CONNECTIONS_PER_HOST,
+                    keepalive_timeout=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=aiohttp.ClientTimeout(total=LLM_TIMEOUT)
+            )
+        return self.session
+
+    # МЕТОД: клиент ChatOpenAI для модели
+    # Клиент создается один раз на модель и использует общий пул соединений;
+    # температура передается с каждым запросом (generate, generate_stream),
+    # поэтому число клиентов не зависит от температур в запросах
+    def chat(self, model: str = LLM_MODEL):
+        if model not in self.chats:
+            self.open()
+            self.chats[model] = ChatOpenAI(
+                model_name=model,
+                temperature=0,
+                openai_api_key=openai.api_key,
+                http_async_client=self.http_client,
+                include_response_headers=True,
+                stream_usage=True
+            )
+        return self.chats[model]
+
+    # МЕТОД: запрос к модели с учетом лимитов
+    #   temperature - температура модели для этого запроса
+    # Возвращает (текст ответа, расход токенов)
+    async def generate(self, chat, messages, temperature: float = 0):
+        limiter = self.limits(chat.model_name)
+        prompt_tokens = count_messages(messages, chat.model_name)
+        await limiter.acquire(prompt_tokens + COMPLETION_RESERVE)
+        response = await chat.agenerate([messages], temperature=temperature)
+        generation = response.generations[0][0]
+        await limiter.update(generation.message.response_metadata.get('headers'))
+        text = generation.text.strip()
+        return text, self.usage(generation.message, prompt_tokens, text, chat.model_name)
+
+    # МЕТОД: потоковый запрос к модели с учетом лимитов
+    # Асинхронный генератор: фрагменты текста, последним - словарь расхода токенов
+    async def generate_stream(self, chat, messages, temperature: float = 0):
+        limiter = self.limits(chat.model_name)
+        prompt_tokens = count_messages(messages, chat.model_name)
+        await limiter.acquire(prompt_tokens + COMPLETION_RESERVE)
+        parts = []
+        last = None
+        async for chunk in chat.astream(messages, temperature=temperature):
+            await limiter.update(chunk.response_metadata.get('headers'))
+            if chunk.usage_metadata:
+                last = chunk
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        yield self.usage(last, prompt_tokens, ''.join(parts), chat.model_name)
+
+    # Расход токенов запроса: по данным OpenAI, а если их нет - по локальному подсчету
+    @staticmethod
+    def usage(message, prompt_tokens: int, text: str, model: str) -> dict:
+        metadata = getattr(message, 'usage_metadata', None)
+        if metadata:
+            return {'prompt_tokens': metadata['input_tokens'], 'completion_tokens': metadata['output_tokens']}
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': count_tokens(text, model)}
+
+    # МЕТОД: эмбеддинги OpenAI за кэшем и микробатчером
+    def create_embeddings(self):
+        self.open()
+        return CachedEmbeddings(
+            OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                openai_api_key=openai.api_key,
+                http_async_client=self.http_client
+            ),
+            model=EMBEDDING_MODEL,
+            path=EMBEDDING_CACHE_PATH,
+            size=EMBEDDING_CACHE_SIZE,
+            disk_size=EMBEDDING_DISK_CACHE_SIZE,
+            window=EMBEDDING_BATCH_WINDOW,
+            batch_size=EMBEDDING_BATCH_SIZE
+        )
+
+    # МЕТОД: освобождение ресурсов при остановке приложения
+    async def close(self):
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
+        if self.embeddings is not None:
+            self.embeddings.close()
+            self.embeddings = None
+        self.chats.clear()
+        self.limits.close()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # МЕТОД: пустое хранилище FAISS с индексом типа INDEX_TYPE
+    #   vectors - эмбеддинги, на которых обучается индекс IVF/PQ
+    def create_store(self, vectors):
+        index = build_index(
+            INDEX_TYPE, np.asarray(vectors, dtype=np.float32),
+            nlist=INDEX_NLIST, pq_m=INDEX_PQ_M, hnsw_m=INDEX_HNSW_M
+        )
+        return FAISS(self.embeddings, index, InMemoryDocstore(), {})
+
+    # МЕТОД: загрузка базы знаний
+    # Если индекса текущей версии документов на диске нет, он обновляется
+    # инкрементально (update_index). Текущий снимок не изменяется: новый индекс
+    # читается с диска отдельно.
+    # Возвращает снимок базы знаний (текущий, если документы не изменились)
+    async def base_load(self):
+        # Документы базы знаний и хэши их содержимого
+        paths = await asyncio.to_thread(list_documents, BASE_DIR, BASE_PATTERNS)
+        hashes = {name: await asyncio.to_thread(file_hash, path) for name, path in paths.items()}
+
+        key = settings_key()
+        version = f'{key}-{manifest_version({name: {"hash": digest} for name, digest in hashes.items()})}'
+        if self.knowledge is not None and self.knowledge.version == version:
+            return self.knowledge
+
+        if self.embeddings is None:
+            self.embeddings = self.create_embeddings()
+        embeddings = self.embeddings
+
+        # Готовый индекс этой версии (например, построенный другим воркером)
+        db = await asyncio.to_thread(self.store.load_version, version, embeddings, INDEX_MMAP)
+        if db is None:
+            # Индекс строит один процесс, остальные ждут блокировку и читают готовый
+            await asyncio.to_thread(self.store.acquire)
+            try:
+                db = await asyncio.to_thread(self.store.load_version, version, embeddings, INDEX_MMAP)
+                if db is None:
+                    db = await self.update_index(key, paths, hashes)
+                    if INDEX_MMAP:
+                        db = await asyncio.to_thread(self.store.load_version, version, embeddings, True)
+            finally:
+                self.store.release()
+        tune_index(db.index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH)
+
+        # Лексический индекс строится по тем же фрагментам, что и FAISS
+        docs = [db.docstore.search(doc_id) for _, doc_id in sorted(db.index_to_docstore_id.items())]
+        lexical = await asyncio.to_thread(BM25Index, [doc.page_content for doc in docs])
+        return Knowledge(db, docs, lexical, version)
+
+    # МЕТОД: инкрементальное обновление индекса на диске
+    # Чанки удаленных и измененных документов удаляются из FAISS по идентификаторам,
+    # заново разбиваются и получают эмбеддинги только новые и измененные документы
+    # (потоковый конвейер api/ingest.py).
+    #   key    - ключ настроек индекса
+    #   paths  - {документ: путь к файлу}
+    #   hashes - {документ: хэш содержимого}
+    # Возвращает обновленный индекс FAISS (в памяти процесса)
+    async def update_index(self, key: str, paths: dict, hashes: dict):
+        ingestor = Ingestor(
+            self, CHUNK_SIZE, CHUNK_OVERLAP, workers=INGEST_WORKERS,
+            train_size=train_size(INDEX_TYPE, INDEX_NLIST)
+        )
+        db, manifest = await ingestor.run(key, paths, hashes)
+        await asyncio.to_thread(self.store.save, key, db, manifest)
+        await asyncio.to_thread(self.store.drop_checkpoint, key)
+        return db
+
+    # МЕТОД: гибридный поиск фрагментов
+    #   vector - эмбеддинг запроса; None - только лексический поиск
+    # Фрагменты с пунктами, на которые ссылается вопрос, идут первыми,
+    # остальные - по объединению (RRF) результатов BM25 и FAISS
+    #   kb     - снимок базы знаний, по которому идет поиск
+    async def hybrid_search(self, query: str, vector, k: int, kb):
+        rankings = [kb.lexical.search(query, HYBRID_CANDIDATES)]
+        if vector is not None:
+            loop = asyncio.get_running_loop()
+            rankings.append(await loop.run_in_executor(
+                self.search_executor, kb.vector_ids, vector, HYBRID_CANDIDATES
+            ))
+        clauses = kb.lexical.clause_docs(query)
+        ids = clauses + [i for i in rrf(rankings, RRF_K) if i not in clauses]
+        return [kb.docs[i] for i in ids[:k]]
+
+    # МЕТОД: ответ из кэша
+    # Возвращает (ответ или None, эмбеддинг запроса или None)
+    # Для вопросов о конкретных пунктах правил эмбеддинг не запрашивается:
+    # нужные фрагменты находит лексический индекс
+    async def cached_answer(self, query: str, key: str, kb):
+        # Точное совпадение с уже заданным вопросом
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer, None
+
+        if kb.lexical.clause_docs(query):
+            return None, None
+
+        # Похожий вопрос: эмбеддинг запроса нужен и для кэша, и для поиска
+        vector = await self.embeddings.aembed_query(query)
+        answer = self.cache.get_similar(vector)
+        if answer is not None:
+            self.cache.put(key, answer)
+        return answer, vector
+
+    # МЕТОД: сообщения для модели по найденным фрагментам базы
+    # Фрагменты очищаются от повторов и укладываются в бюджет токенов CONTEXT_TOKENS.
+    # Возвращает список сообщений или None, если ничего не найдено
+    async def answer_messages(self, query: str, vector, kb):
         # Поиск в базе
-        docs = self.db.similarity_search(query, k=4)
+        docs = await self.hybrid_search(query, vector, CONTEXT_K, kb)
         if not docs:
-            return "Извините, я не смог найти информацию для ответа на ваш вопрос."
+            return None
 
-        message_content = '\n'.join([doc.page_content for doc in docs])
+        message_content, _ = assemble_context(
+            [doc.page_content for doc in docs], CONTEXT_TOKENS, LLM_MODEL
+        )
 
         # Формирование промпта
         user = f'''
@@ -70,20 +512,80 @@ class Chunk:
         '''
 
         # Создание сообщений
-        messages = [
+        return [
             SystemMessage(content=self.system),
             HumanMessage(content=user)
         ]
 
-        # Инициализация ChatOpenAI
-        chat = ChatOpenAI(model_name='gpt-4', temperature=0, openai_api_key=openai.api_key)
+    async def get_answer(self, query: str):
+        return (await self.answer(query))['message']
+
+    # МЕТОД: ответ на вопрос с расходом токенов
+    # Одинаковые вопросы, заданные одновременно, обрабатываются один раз
+    # Возвращает {'message': текст, 'usage': {'prompt_tokens', 'completion_tokens'}}
+    async def answer(self, query: str):
+        key = normalize(query)
+        return await self.flights.do(('answer', key), lambda: self.compute_answer(query, key))
+
+    # МЕТОД: ответ на вопрос (кэш, поиск, запрос к модели)
+    # Весь ответ строится по одному снимку базы знаний, взятому в начале
+    async def compute_answer(self, query: str, key: str):
+        kb = self.knowledge
+        answer, vector = await self.cached_answer(query, key, kb)
+        if answer is not None:
+            return {'message': answer, 'usage': dict(NO_USAGE, cached=True)}
+
+        messages = await self.answer_messages(query, vector, kb)
+        if messages is None:
+            return {'message': NOT_FOUND, 'usage': dict(NO_USAGE)}
+
+        # Общий клиент ChatOpenAI
+        chat = self.chat()
 
         try:
             # Получение ответа
-            response = await chat.agenerate([messages])
-            return response.generations[0][0].text.strip()
+            answer, usage = await self.generate(chat, messages)
+        except Exception as e:
+            return {'message': f"Произошла ошибка: {e}", 'usage': dict(NO_USAGE)}
+
+        # Ошибки не кэшируются, успешный ответ сохраняем в оба уровня,
+        # если за время ответа база знаний не была перезагружена
+        if kb is self.knowledge:
+            self.cache.put(key, answer, vector)
+        return {'message': answer, 'usage': usage}
+
+    # МЕТОД: потоковый ответ на вопрос к базе знаний
+    # Асинхронный генератор, отдает фрагменты текста по мере их получения от модели,
+    # последним - словарь расхода токенов.
+    # При закрытии генератора (клиент отключился) поток от OpenAI прерывается.
+    async def get_answer_stream(self, query: str):
+        key = normalize(query)
+        kb = self.knowledge
+        answer, vector = await self.cached_answer(query, key, kb)
+        if answer is not None:
+            yield answer
+            yield dict(NO_USAGE, cached=True)
+            return
+
+        messages = await self.answer_messages(query, vector, kb)
+        if messages is None:
+            yield NOT_FOUND
+            yield dict(NO_USAGE)
+            return
+
+        parts = []
+        try:
+            async for token in self.generate_stream(self.chat(), messages):
+                if isinstance(token, str):
+                    parts.append(token)
+                yield token
         except Exception as e:
-            return f"Произошла ошибка: {e}"
+            yield f"Произошла ошибка: {e}"
+            return
+
+        # В кэш попадает только полностью полученный ответ по текущей версии базы
+        if kb is self.knowledge:
+            self.cache.put(key, ''.join(parts).strip(), vector)
 
     async def get_answer_async(self, query: str):
         # Асинхронный вызов
@@ -98,31 +600,133 @@ class Chunk:
         :param temp: Температура (креативность) модели.
         :param format: Словарь с дополнительными настройками (необязательно).
         """
-        # Формируем список сообщений для ChatOpenAI
+        return (await self.complete(system, user, temp, format))['message']
+
+    # МЕТОД: запрос к модели с расходом токенов
+    # Возвращает {'message': текст или описание ошибки, 'usage': {...}}
+    async def complete(self, system: str, user: str, temp: float = 0.5, format: dict = None):
+        try:
+            return await self.request_raw(system, user, temp, format)
+        except Exception as e:
+            return {'message': f"Произошла ошибка: {e}", 'usage': dict(NO_USAGE)}
+
+    # МЕТОД: запрос к модели без перехвата ошибок
+    # Одинаковые одновременные запросы выполняются один раз
+    async def request_raw(self, system: str, user: str, temp: float = 0.5, format: dict = None):
+        key = ('request', system, user, float(temp), json.dumps(format, sort_keys=True))
+        return await self.flights.do(key, lambda: self.compute_request(system, user, temp))
+
+    # МЕТОД: запрос к модели (без объединения)
+    async def compute_request(self, system: str, user: str, temp: float):
+        messages = self.request_messages(system, user)
+
+        # Общий клиент ChatOpenAI (LangChain), температура - параметр запроса
+        chat = self.chat()
+        message, usage = await self.generate(chat, messages, temperature=temp)
+        return {'message': message, 'usage': usage}
+
+    # МЕТОД: пакет запросов к модели
+    #   items       - список словарей {system, user, temperature, format}
+    #   concurrency - максимальное число одновременных запросов
+    # Запросы проходят через общий ограничитель скорости.
+    # Возвращает результаты в исходном порядке: {'message', 'usage'} или {'error': ...}
+    async def request_batch(self, items: list, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(item):
+            async with semaphore:
+                try:
+                    return await self.request_raw(
+                        item.get('system', ''), item.get('user', ''),
+                        item.get('temperature', 0.5), item.get('format')
+                    )
+                except Exception as e:
+                    return {'error': str(e) or e.__class__.__name__}
+
+        return await asyncio.gather(*(one(item) for item in items))
+
+    # Потоковый вариант request: отдает фрагменты текста по мере генерации,
+    # последним - словарь расхода токенов
+    async def request_stream(self, system: str, user: str, temp: float = 0.5, format: dict = None):
+        messages = self.request_messages(system, user)
+        try:
+            async for token in self.generate_stream(self.chat(), messages, temperature=temp):
+                yield token
+        except Exception as e:
+            yield f"Произошла ошибка: {e}"
+
+    # Формируем список сообщений для ChatOpenAI
+    @staticmethod
+    def request_messages(system: str, user: str):
         messages = []
         if system:  # Если system не пустой, добавим SystemMessage
             messages.append(SystemMessage(content=system))
 
         # Добавляем сообщение пользователя
         messages.append(HumanMessage(content=user))
+        return messages
+    # ===================================================
 
-        # Инициализируем ChatOpenAI (LangChain)
-        chat = ChatOpenAI(
-            model_name='gpt-4',
-            temperature=temp,
-            openai_api_key=openai.api_key
-        )
+    # МЕТОД: тело запроса распознавания изображения
+    #   text  - текст для роли 'user'
+    #   image - картинка в формате base64 (str или bytes)
+    # Промпт сериализуется orjson с меткой вместо картинки, а картинка вставляется
+    # между готовыми частями: многомегабайтная строка не проходит через
+    # JSON-сериализатор и копируется один раз - в итоговое тело запроса.
+    @staticmethod
+    def ocr_payload(text: str, image) -> bytes:
+        if isinstance(image, str):
+            image = image.encode('ascii', errors='replace')
+        # символы base64 не требуют экранирования в JSON, остальное отклоняем
+        if not BASE64_RE.fullmatch(image):
+            raise HTTPException(status_code=400, detail='Изображение должно быть в формате base64')
+
+        template = orjson.dumps({
+            'model': OCR_MODEL,
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': [
+                        { 'type': 'text', 'text': text },
+                        {
+                            'type': 'image_url', 'image_url': {
+                                'url': IMAGE_PLACEHOLDER
+                            }
+                        }
+                    ]
+                }
+            ]
+        })
+        # метка картинки идет после текста, поэтому ищем последнее вхождение
+        head, tail = template.rsplit(IMAGE_PLACEHOLDER.encode('ascii'), 1)
+        return b''.join((head, b'data:image/jpeg;base64,', image, tail))
+
+    # МЕТОД: распознавание загруженного файла изображения
+    #   data    - файл изображения (bytes)
+    #   text    - текст для роли 'user'
+    #   file_id - постоянный идентификатор файла (file_unique_id в Telegram), необязательно
+    # Картинка уменьшается и пересжимается, повторы отдаются из кэша без запроса к модели.
+    # Возвращает текст
+    async def ocr_file(self, data: bytes, text: str, file_id: str = None):
+        answer = self.ocr_cache.get_file(file_id, text)
+        if answer is not None:
+            return answer
 
         try:
-            response = await chat.agenerate([messages])
-            return response.generations[0][0].text.strip()
-        except Exception as e:
-            return f"Произошла ошибка: {e}"
-    # ===================================================
+            image, phash = await asyncio.to_thread(prepare_image, data, OCR_MAX_EDGE, OCR_JPEG_QUALITY)
+        except (OSError, Image.DecompressionBombError) as e:
+            # OSError включает UnidentifiedImageError; слишком большое по пикселям - тоже 400
+            raise HTTPException(status_code=400, detail=f'Не удалось открыть изображение: {e}')
+
+        answer = self.ocr_cache.get_hash(phash, text)
+        if answer is None:
+            answer = await self.ocr_image({'image': base64.b64encode(image), 'text': text})
+        self.ocr_cache.put(phash, file_id, text, answer)
+        return answer
 
     # МЕТОД: распознавание изображения
     #   param = {
-    #       image  - картинка в формате base64
+    #       image  - картинка в формате base64 (str или bytes)
     #       text   - текст для роли 'user'
     #   }
     # Возвращает текст
@@ -135,85 +739,59 @@ class Chunk:
         }
         
         # промпт
-        payload = {
-            'model': 'gpt-4o-mini',
-            'messages': [
-                {
-                    'role': 'user', 
-                    'content': [
-                        { 'type': 'text', 'text': param['text'] },
-                        {
-                            'type': 'image_url', 'image_url': {
-                                'url': f'data:image/jpeg;base64, {param["image"]}'
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
+        payload = self.ocr_payload(param['text'], param['image'])
 
-        # выполнение запроса
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers=headers,
-                json=payload
-            ) as response:
-                try:
-                    # получение результата
-                    result = await response.json()
-                    
-                    # обработка заголовков ограничения скорости
-                    rate_limit_headers = {
-                        'limit_requests': int(response.headers.get('x-ratelimit-limit-requests')),
-                        'limit_tokens': int(response.headers.get('x-ratelimit-limit-tokens')),
-                        'remaining_requests': int(response.headers.get('x-ratelimit-remaining-requests')),
-                        'remaining_tokens': int(response.headers.get('x-ratelimit-remaining-tokens')),
-                        'reset_tokens': int(response.headers.get('x-ratelimit-reset-tokens').replace('ms', '')),
-                        'reset_requests': int(float(response.headers.get('x-ratelimit-reset-requests').replace('s', '')) * 1000)
-                    }
-                    
-                    # проверка оставшихся запросов и токенов
-                    if rate_limit_headers['remaining_requests'] and rate_limit_headers['remaining_requests'] <= 0:
-                        reset_time = rate_limit_headers['reset_requests']
-                        time.sleep(reset_time)  # Задержка до сброса лимита
-
-                    if rate_limit_headers['remaining_tokens'] and rate_limit_headers['remaining_tokens'] <= 0:
-                        reset_time = rate_limit_headers['reset_tokens']
-                        time.sleep(reset_time)  # Задержка до сброса лимита
-
-                    # проверка на наличие ошибок в ответе
-                    if 'error' in result:
-                        message = result['error']['message']
-                        print(message)
-                        raise HTTPException(status_code=400, detail=message)
-
-                    # получение ответа
-                    if 'choices' in result:
-                        return result['choices'][0]['message']['content']
-                    else:
-                        message = 'Response does not contain "choices"'
-                        print(message)
-                        raise HTTPException(status_code=500, detail=message)
-
-                except aiohttp.ContentTypeError as e:
-                    message = f'ContentTypeError: {str(e)}'
+        # ожидание разрешения ограничителя скорости (без блокировки цикла событий)
+        limiter = self.limits(OCR_MODEL)
+        await limiter.acquire(count_tokens(param['text'], OCR_MODEL) + OCR_IMAGE_TOKENS)
+
+        # выполнение запроса через общую сессию
+        session = self.ocr_session()
+        async with session.post(OCR_URL, headers=headers, data=payload) as response:
+            try:
+                # получение результата
+                result = await response.json(loads=orjson.loads)
+                
+                # обработка заголовков ограничения скорости: следующие запросы
+                # подождут сброса лимита в limiter.acquire
+                await limiter.update(response.headers)
+
+                # проверка на наличие ошибок в ответе
+                if 'error' in result:
+                    message = result['error']['message']
                     print(message)
-                    raise HTTPException(status_code=500, detail=message)
-                except json.JSONDecodeError as e:
-                    message = f'JSONDecodeError: {str(e)}'
+                    raise HTTPException(status_code=400, detail=message)
+
+                # получение ответа
+                if 'choices' in result:
+                    return result['choices'][0]['message']['content']
+                else:
+                    message = 'Response does not contain "choices"'
                     print(message)
                     raise HTTPException(status_code=500, detail=message)
 
+            except aiohttp.ContentTypeError as e:
+                message = f'ContentTypeError: {str(e)}'
+                print(message)
+                raise HTTPException(status_code=500, detail=message)
+            except json.JSONDecodeError as e:
+                message = f'JSONDecodeError: {str(e)}'
+                print(message)
+                raise HTTPException(status_code=500, detail=message)
+
 
 # Запуск программы
 if __name__ == "__main__":
     chunk = Chunk()
     query = 'Какие исключения предусмотрены в страховом договоре?'
 
+    async def main():
+        await chunk.start()
+        return await chunk.get_answer(query)
+
     try:
         # Запускаем асинхронную функцию
-        result = asyncio.run(chunk.get_answer(query))
+        result = asyncio.run(main())
         print(result)
     except Exception as e:
         print(f"Ошибка: {e}")
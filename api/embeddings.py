@@ -0,0 +1,237 @@
+# Слой эмбеддингов перед OpenAIEmbeddings
+#
+# - кэш в памяти (LRU) и на диске (SQLite) по хэшу текста и модели;
+# - микробатчинг: одиночные запросы aembed_query, пришедшие в пределах
+#   короткого окна, объединяются в один вызов API, одинаковые тексты
+#   внутри окна считаются один раз.
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, inner: Embeddings, model: str, path: str = None,
+                 size: int = 10000, disk_size: int = 200000,
+                 window: float = 0.005, batch_size: int = 256):
+        self.inner = inner
+        self.model = model
+        self.size = size
+        self.disk_size = disk_size
+        self.window = window
+        self.batch_size = batch_size
+
+        # кэш в памяти: ключ -> вектор float32
+        self.memory = OrderedDict()
+
+        # кэш на диске (необязательный)
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)'
+            )
+
+        # ожидающие запросы текущего окна: ключ -> (текст, future)
+        self.pending = {}
+        self.flush_handle = None
+        # запущенные вызовы API по окнам (ссылки держатся до завершения)
+        self._tasks = set()
+
+        # счетчики
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    # ключ кэша: модель + текст
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f'{self.model}\0{text}'.encode('utf-8')).hexdigest()
+
+    # ---------- кэш в памяти ----------
+
+    def _memory_get(self, key: str):
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            self.hits_memory += 1
+        return vector
+
+    def _memory_put(self, key: str, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    # ---------- кэш на диске ----------
+
+    def _disk_get(self, keys: list) -> dict:
+        if self.db is None or not keys:
+            return {}
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self.db.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(part))})',
+                    part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        self.hits_disk += len(found)
+        return found
+
+    def _disk_put(self, items: dict):
+        if self.db is None or not items:
+            return
+        with self.lock:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                [(key, vector.tobytes()) for key, vector in items.items()]
+            )
+            # ограничение размера: удаляем самые старые записи
+            self.db.execute(
+                'DELETE FROM embeddings WHERE rowid <= '
+                '(SELECT MAX(rowid) FROM embeddings) - ?', (self.disk_size,)
+            )
+            self.db.commit()
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for _, future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        for task in self._tasks:
+            task.cancel()
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+            self.db = None
+
+    # ---------- общий путь: кэш -> API ----------
+
+    # Возвращает словарь ключ -> вектор для текстов, которых нет в памяти
+    def _lookup(self, texts: list, keys: list):
+        result = {}
+        missing = {}
+        for text, key in zip(texts, keys):
+            vector = self._memory_get(key)
+            if vector is not None:
+                result[key] = vector
+            else:
+                missing[key] = text
+        return result, missing
+
+    def _store(self, found: dict):
+        for key, vector in found.items():
+            self._memory_put(key, vector)
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [self.key(text) for text in texts]
+        result, missing = self._lookup(texts, keys)
+        if missing:
+            found = self._disk_get(list(missing))
+            rest = [key for key in missing if key not in found]
+            if rest:
+                self.misses += len(rest)
+                self.api_calls += 1
+                vectors = self.inner.embed_documents([missing[key] for key in rest])
+                computed = {key: np.asarray(v, dtype=np.float32) for key, v in zip(rest, vectors)}
+                self._disk_put(computed)
+                found.update(computed)
+            self._store(found)
+            result.update(found)
+        return [result[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        keys = [self.key(text) for text in texts]
+        result, missing = self._lookup(texts, keys)
+        if missing:
+            found = await self._afetch(missing)
+            result.update(found)
+        return [result[key].tolist() for key in keys]
+
+    # МЕТОД: эмбеддинг одного запроса через микробатчер
+    async def aembed_query(self, text: str) -> list:
+        key = self.key(text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            return vector.tolist()
+
+        loop = asyncio.get_running_loop()
+        if key in self.pending:
+            future = self.pending[key][1]
+        else:
+            future = loop.create_future()
+            self.pending[key] = (text, future)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            elif self.flush_handle is None:
+                self.flush_handle = loop.call_later(self.window, self._flush)
+        vector = await asyncio.shield(future)
+        return vector.tolist()
+
+    # отправка накопленного окна одним вызовом
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._resolve(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, batch: dict):
+        try:
+            found = await self._afetch({key: text for key, (text, _) in batch.items()})
+        except asyncio.CancelledError:
+            for _, future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(found[key])
+
+    # диск -> API для набора текстов, результат кладется в память
+    async def _afetch(self, missing: dict) -> dict:
+        found = await asyncio.to_thread(self._disk_get, list(missing))
+        rest = [key for key in missing if key not in found]
+        if rest:
+            self.misses += len(rest)
+            self.api_calls += 1
+            vectors = await self.inner.aembed_documents([missing[key] for key in rest])
+            computed = {key: np.asarray(v, dtype=np.float32) for key, v in zip(rest, vectors)}
+            await asyncio.to_thread(self._disk_put, computed)
+            found.update(computed)
+        self._store(found)
+        return found
+
+    # МЕТОД: статистика кэша эмбеддингов
+    def stats(self) -> dict:
+        return {
+            'memory_size': len(self.memory),
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'api_calls': self.api_calls,
+        }
@@ -0,0 +1,123 @@
+# Подготовка изображений перед распознаванием
+#
+# - уменьшение до заданной длинной стороны и пересжатие в JPEG: меньше байт
+#   в запросе и меньше токенов изображения у модели;
+# - перцептивный хэш (dHash), устойчивый к пересжатию и масштабу, для поиска
+#   повторно присланных картинок;
+# - кэш результатов распознавания по хэшу и по file_unique_id из Telegram.
+
+import io
+import time
+from collections import OrderedDict
+
+from PIL import ExifTags, Image, ImageOps
+
+# Тег EXIF с ориентацией снимка (1 - без поворота)
+ORIENTATION = ExifTags.Base.Orientation
+
+
+# ФУНКЦИЯ: перцептивный хэш изображения (dHash, 64 бита)
+def dhash(image: Image.Image) -> int:
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+# ФУНКЦИЯ: подготовка изображения
+#   data     - исходный файл изображения
+#   max_edge - максимальная длина стороны в пикселях
+#   quality  - качество JPEG
+# Возвращает (байты JPEG, перцептивный хэш)
+def prepare_image(data: bytes, max_edge: int, quality: int):
+    image = Image.open(io.BytesIO(data))
+    # формат известен только у открытого файла: копия после поворота его теряет
+    source_format = image.format
+    orientation = image.getexif().get(ORIENTATION, 1)
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    phash = dhash(image)
+
+    # небольшой JPEG без поворота отправляем как есть, без повторного сжатия
+    if source_format == 'JPEG' and orientation == 1 and max(image.size) <= max_edge:
+        return data, phash
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue(), phash
+
+
+# Кэш результатов распознавания
+class OcrCache:
+    def __init__(self, size: int = 1000, ttl: float = 86400, distance: int = 4):
+        self.size = size
+        self.ttl = ttl
+        self.distance = distance
+        # (тип ключа, ключ, текст запроса) -> (время истечения, ответ)
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires, answer = item
+        if expires <= time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return answer
+
+    # МЕТОД: поиск по file_unique_id (до скачивания и обработки картинки)
+    def get_file(self, file_id: str, text: str):
+        answer = self._get(('file', file_id, text)) if file_id else None
+        if answer is not None:
+            self.hits += 1
+        return answer
+
+    # МЕТОД: поиск по перцептивному хэшу с допуском по расстоянию Хэмминга
+    def get_hash(self, phash: int, text: str):
+        answer = self._get(('hash', phash, text))
+        if answer is None and self.distance:
+            # сначала собираем подходящие ключи: _get удаляет устаревшие записи
+            # и переставляет найденные, менять словарь во время обхода нельзя
+            near = [
+                key for key in reversed(self.items)
+                if key[0] == 'hash' and key[2] == text and bin(key[1] ^ phash).count('1') <= self.distance
+            ]
+            for key in near:
+                answer = self._get(key)
+                if answer is not None:
+                    break
+        if answer is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return answer
+
+    # МЕТОД: сохранение результата
+    def put(self, phash: int, file_id: str, text: str, answer: str):
+        expires = time.monotonic() + self.ttl
+        keys = [('hash', phash, text)]
+        if file_id:
+            keys.append(('file', file_id, text))
+        for key in keys:
+            self.items[key] = (expires, answer)
+            self.items.move_to_end(key)
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses}
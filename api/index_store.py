@@ -0,0 +1,209 @@
+# Хранилище векторного индекса на диске
+#
+# Индекс FAISS вместе с docstore и манифестом документов сохраняется в отдельный
+# каталог "<ключ настроек>-<версия базы>". Ключ настроек - хэш от настроек
+# разбиения на чанки и модели эмбеддингов: при их изменении индекс строится
+# заново. Версия базы - хэш от содержимого всех документов. Манифест хранит для
+# каждого документа хэш содержимого и идентификаторы его чанков в индексе, чтобы
+# при изменении базы переиндексировать только измененные документы.
+#
+# Для работы в нескольких процессах индекс строит один из них (под файловой
+# блокировкой), а остальные читают готовый каталог. В режиме mmap индекс
+# отображается в память только для чтения, и страницы с векторами общие
+# для всех воркеров на машине.
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from api.ann import mmap_index, read_mmap
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+# каталог с индексами по умолчанию
+INDEX_DIR = os.path.join(os.path.dirname(__file__), 'index')
+# файл манифеста документов в каталоге индекса
+MANIFEST = 'manifest.json'
+# индекс для отображения в память (если index.faiss отобразить нельзя)
+MMAP_INDEX = 'index.mmap'
+
+
+# ФУНКЦИЯ: ключ индекса
+#   content  - содержимое исходного файла (bytes)
+#   settings - настройки, влияющие на индекс (размер чанка, модель и т.д.)
+# Возвращает строку-хэш
+def index_key(content: bytes, settings: dict) -> str:
+    digest = hashlib.sha256()
+    digest.update(content)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+# ФУНКЦИЯ: версия базы знаний по манифесту документов
+def manifest_version(manifest: dict) -> str:
+    hashes = {name: item['hash'] for name, item in manifest.items()}
+    return index_key(b'', hashes)[:16]
+
+
+class IndexStore:
+    def __init__(self, root: str = INDEX_DIR):
+        self.root = root
+        self.lock_file = None
+
+    # путь к каталогу индекса с заданным именем
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # МЕТОД: имя последнего сохраненного каталога индекса для ключа настроек
+    def current(self, key: str):
+        if not os.path.isdir(self.root):
+            return None
+        names = [
+            name for name in os.listdir(self.root)
+            if name.startswith(f'{key}-') and os.path.exists(os.path.join(self.root, name, MANIFEST))
+        ]
+        if not names:
+            return None
+        return max(names, key=lambda name: os.path.getmtime(self.path(name)))
+
+    # МЕТОД: загрузка индекса заданной версии
+    #   name - имя каталога индекса ("<ключ настроек>-<версия базы>")
+    #   mmap - отобразить индекс в память только для чтения
+    # Возвращает FAISS или None, если такой версии нет
+    def load_version(self, name: str, embeddings, mmap: bool = False):
+        path = self.path(name)
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            return None
+        if not mmap:
+            return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+        mapped = os.path.join(path, MMAP_INDEX)
+        if os.path.exists(mapped):
+            index = read_mmap(mapped)
+        else:
+            # IVF отображается напрямую, остальные типы (HNSW) читаются целиком
+            index = read_mmap(os.path.join(path, 'index.faiss'))
+            if faiss.try_extract_index_ivf(index) is None:
+                print(f'Индекс {name} нельзя отобразить в память, он загружен целиком')
+        # docstore сериализуется pickle-ом, файл создаем только мы сами
+        with open(os.path.join(path, 'index.pkl'), 'rb') as file:
+            docstore, index_to_docstore_id = pickle.load(file)
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    # МЕТОД: блокировка построения индекса между процессами
+    def acquire(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.lock_file = open(os.path.join(self.root, '.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    def release(self):
+        if self.lock_file is not None:
+            if fcntl is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    # МЕТОД: загрузка индекса
+    # Возвращает (FAISS, манифест) или (None, {}), если индекса с таким ключом нет
+    def load(self, key: str, embeddings):
+        name = self.current(key)
+        if name is None:
+            return None, {}
+        path = self.path(name)
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as file:
+            manifest = json.load(file)
+        # docstore сериализуется pickle-ом, файл создаем только мы сами
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True), manifest
+
+    # МЕТОД: сохранение индекса
+    #   key      - ключ настроек
+    #   db       - индекс FAISS
+    #   manifest - {документ: {'hash': хэш содержимого, 'ids': идентификаторы чанков}}
+    # Запись идет во временный каталог, который затем переименовывается,
+    # поэтому параллельно стартующий процесс не увидит недописанный индекс.
+    # Возвращает имя каталога индекса
+    def save(self, key: str, db, manifest: dict) -> str:
+        name = f'{key}-{manifest_version(manifest)}'
+        os.makedirs(self.root, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f'.{name}-', dir=self.root)
+        try:
+            self._write(tmp, db, manifest)
+            # точный индекс дополнительно сохраняется в виде, пригодном для mmap
+            index = mmap_index(db.index)
+            if index is not None and index is not db.index:
+                faiss.write_index(index, os.path.join(tmp, MMAP_INDEX))
+            try:
+                os.replace(tmp, self.path(name))
+            except OSError:
+                # индекс этой версии уже сохранил другой процесс
+                shutil.rmtree(tmp, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.prune(keep=name)
+        return name
+
+    @staticmethod
+    def _write(path: str, db, manifest: dict):
+        db.save_local(path)
+        with open(os.path.join(path, MANIFEST), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False)
+
+    # ---------- контрольные точки загрузки (api/ingest.py) ----------
+
+    def checkpoint_path(self, key: str) -> str:
+        return self.path(f'.ingest-{key}')
+
+    # МЕТОД: сохранение промежуточного состояния загрузки
+    # Предыдущая контрольная точка удаляется только после записи новой
+    def save_checkpoint(self, key: str, db, manifest: dict):
+        path = self.checkpoint_path(key)
+        os.makedirs(self.root, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f'.ingest-{key}-', dir=self.root)
+        try:
+            self._write(tmp, db, manifest)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        old = path + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    # МЕТОД: загрузка контрольной точки
+    # Возвращает (FAISS, манифест) или (None, {}), если контрольной точки нет
+    def load_checkpoint(self, key: str, embeddings):
+        path = self.checkpoint_path(key)
+        for candidate in (path, path + '.old'):
+            if os.path.exists(os.path.join(candidate, MANIFEST)):
+                with open(os.path.join(candidate, MANIFEST), encoding='utf-8') as file:
+                    manifest = json.load(file)
+                return FAISS.load_local(candidate, embeddings, allow_dangerous_deserialization=True), manifest
+        return None, {}
+
+    # МЕТОД: удаление контрольной точки после успешного завершения загрузки
+    def drop_checkpoint(self, key: str):
+        prefix = os.path.basename(self.checkpoint_path(key))
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.startswith(prefix):
+                    shutil.rmtree(self.path(name), ignore_errors=True)
+
+    # МЕТОД: удаление устаревших индексов (файлы в корне, например кэш эмбеддингов, не трогаем)
+    def prune(self, keep: str):
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != keep and not name.startswith('.') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
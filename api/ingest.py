@@ -0,0 +1,351 @@
+# Потоковая загрузка документов в индекс базы знаний
+#
+# Запуск:
+#   python -m api.ingest --base api/base --batch-size 256 --concurrency 4 --workers 8
+#
+# Конвейер:
+#   1. файлы перебираются по одному, хэш содержимого считается потоково;
+#   2. разбиение на чанки идет в пуле процессов, впереди читается не больше
+#      нескольких документов на процесс;
+#   3. чанки собираются в пакеты по batch_size и отправляются на эмбеддинг,
+#      одновременно не больше concurrency запросов, с повторами при ошибках;
+#   4. векторы добавляются в индекс по мере готовности, в исходном порядке.
+# В памяти одновременно находятся только пакеты в работе, поэтому память не
+# зависит от размера корпуса. Каждые checkpoint_every документов состояние
+# сохраняется в контрольную точку, и после сбоя загрузка продолжается с нее.
+#
+# Тот же конвейер обновляет индекс при старте и перезагрузке API (Chunk.update_index).
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from tenacity import AsyncRetrying, stop_after_attempt, wait_random_exponential
+import numpy as np
+
+from api.ann import MIN_POINTS_PER_CENTROID, supports_remove
+
+# Настройки по умолчанию
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '256'))
+INGEST_CONCURRENCY = int(os.getenv('INGEST_CONCURRENCY', '4'))
+INGEST_RETRIES = int(os.getenv('INGEST_RETRIES', '5'))
+INGEST_CHECKPOINT_EVERY = int(os.getenv('INGEST_CHECKPOINT_EVERY', '50'))
+
+# Размер блока при чтении файла для хэша
+READ_BLOCK = 1 << 20
+
+
+# ФУНКЦИЯ: документы каталога базы знаний
+# Возвращает {имя файла относительно base_dir: путь}
+def list_documents(base_dir: str, patterns) -> dict:
+    if not os.path.isdir(base_dir):
+        raise FileNotFoundError(f"Каталог {base_dir} не найден.")
+    paths = {
+        os.path.relpath(path, base_dir): path
+        for pattern in patterns
+        for path in glob.glob(os.path.join(base_dir, '**', pattern), recursive=True)
+    }
+    if not paths:
+        raise FileNotFoundError(f"В каталоге {base_dir} нет документов.")
+    return dict(sorted(paths.items()))
+
+
+# ФУНКЦИЯ: хэш содержимого файла (читается блоками)
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+# ФУНКЦИЯ: разбиение документа на чанки (выполняется в пуле процессов)
+# Идентификаторы чанков уникальны для имени и содержимого документа
+# Возвращает (тексты чанков, идентификаторы)
+def split_file(path: str, name: str, digest: str, chunk_size: int, chunk_overlap: int):
+    with open(path, 'rb') as file:
+        text = file.read().decode('utf-8')
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    texts = splitter.split_text(text)
+    return texts, [f'{name}:{digest[:12]}:{i}' for i in range(len(texts))]
+
+
+# Пакет чанков на эмбеддинг
+class _Batch:
+    __slots__ = ('texts', 'metadatas', 'ids', 'finished')
+
+    def __init__(self):
+        self.texts = []
+        self.metadatas = []
+        self.ids = []
+        # документы, последний чанк которых попал в этот пакет: (имя, хэш, идентификаторы)
+        self.finished = []
+
+
+class Ingestor:
+    #   chunk            - экземпляр Chunk (хранилище, эмбеддинги, создание индекса)
+    #   batch_size       - чанков в одном запросе эмбеддингов
+    #   concurrency      - одновременных запросов эмбеддингов
+    #   workers          - процессов для разбиения (0 - поток в текущем процессе)
+    #   checkpoint_every - документов между контрольными точками (0 - без них)
+    #   train_size       - векторов, на которых обучается новый IVF-индекс
+    def __init__(self, chunk, chunk_size: int, chunk_overlap: int,
+                 batch_size: int = INGEST_BATCH_SIZE, concurrency: int = INGEST_CONCURRENCY,
+                 workers: int = 0, checkpoint_every: int = INGEST_CHECKPOINT_EVERY,
+                 retries: int = INGEST_RETRIES, train_size: int = 0):
+        self.chunk = chunk
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.workers = workers
+        self.checkpoint_every = checkpoint_every
+        self.retries = retries
+        self.train_size = train_size
+
+        self.key = None
+        self.db = None
+        self.manifest = {}
+        # векторы, накопленные для обучения нового индекса: массив float32
+        # (train_size + batch_size) x dim, число заполненных строк и пакеты с их строками
+        self.train_vectors = None
+        self.train_count = 0
+        self.train = []
+        self.since_checkpoint = 0
+        # счетчики
+        self.documents = 0
+        self.chunks = 0
+        self.started = None
+
+    # МЕТОД: загрузка документов в индекс
+    #   key    - ключ настроек индекса
+    #   paths  - {документ: путь к файлу}
+    #   hashes - {документ: хэш содержимого}
+    # Возвращает (индекс FAISS, манифест)
+    async def run(self, key: str, paths: dict, hashes: dict):
+        store = self.chunk.store
+        embeddings = self.chunk.embeddings
+        self.key = key
+        self.started = time.monotonic()
+
+        # Продолжение прерванной загрузки или обновление сохраненного индекса
+        db, manifest = await asyncio.to_thread(store.load_checkpoint, key, embeddings)
+        if db is not None:
+            print(f'Продолжение загрузки: готово документов {len(manifest)}')
+            db = self._drop_orphans(db, manifest)
+            if db is None:
+                manifest = {}
+        if db is None:
+            db, manifest = await asyncio.to_thread(store.load, key, embeddings)
+
+        removed = [name for name, item in manifest.items() if hashes.get(name) != item['hash']]
+        added = [name for name, digest in hashes.items() if manifest.get(name, {}).get('hash') != digest]
+
+        if db is not None and removed and not supports_remove(db.index):
+            # из IVF и HNSW нельзя удалять (см. supports_remove): индекс строится
+            # заново, эмбеддинги неизмененных документов берутся из кэша
+            db, manifest, added = None, {}, list(hashes)
+        if db is not None and removed:
+            db.delete([doc_id for name in removed for doc_id in manifest.pop(name)['ids']])
+
+        self.db, self.manifest = db, manifest
+        if added:
+            await self._ingest((name, paths[name], hashes[name]) for name in added)
+            print(f'База знаний: добавлено {len(added)}, удалено {len(removed)} документов, '
+                  f'чанков {self.chunks} за {time.monotonic() - self.started:.1f} с')
+        elif removed:
+            print(f'База знаний: удалено {len(removed)} документов')
+        return self.db, self.manifest
+
+    # Удаление из контрольной точки чанков документов, которые не успели загрузиться целиком
+    # Возвращает индекс или None, если удалить их нельзя (IVF, HNSW)
+    @staticmethod
+    def _drop_orphans(db, manifest: dict):
+        known = {doc_id for item in manifest.values() for doc_id in item['ids']}
+        orphans = [doc_id for doc_id in db.index_to_docstore_id.values() if doc_id not in known]
+        if not orphans:
+            return db
+        if not supports_remove(db.index):
+            return None
+        db.delete(orphans)
+        return db
+
+    # ---------- конвейер ----------
+
+    async def _ingest(self, items):
+        pool = None
+        if self.workers > 0:
+            # spawn: процессы не наследуют потоки и цикл событий родителя
+            pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        in_flight = deque()
+        try:
+            batch = _Batch()
+            async for name, digest, texts, ids in self._split(items, pool):
+                if not texts:
+                    self._finish([(name, digest, ids)])
+                    continue
+                for i, text in enumerate(texts):
+                    batch.texts.append(text)
+                    batch.metadatas.append({'source': name})
+                    batch.ids.append(ids[i])
+                    if i == len(texts) - 1:
+                        batch.finished.append((name, digest, ids))
+                    if len(batch.texts) >= self.batch_size:
+                        await self._submit(batch, in_flight)
+                        batch = _Batch()
+            if batch.texts:
+                await self._submit(batch, in_flight)
+            while in_flight:
+                await self._complete(in_flight.popleft())
+            if self.train:
+                await self._add_training()
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    # Разбиение документов с ограниченным опережением, результаты - в исходном порядке
+    async def _split(self, items, pool):
+        loop = asyncio.get_running_loop()
+        ahead = max(1, self.workers) * 2
+        window = deque()
+        for name, path, digest in items:
+            future = loop.run_in_executor(
+                pool, split_file, path, name, digest, self.chunk_size, self.chunk_overlap
+            )
+            window.append((name, digest, future))
+            if len(window) >= ahead:
+                name, digest, future = window.popleft()
+                yield (name, digest, *await future)
+        while window:
+            name, digest, future = window.popleft()
+            yield (name, digest, *await future)
+
+    # Отправка пакета на эмбеддинг; при заполненном окне ждем самый старый пакет
+    async def _submit(self, batch: _Batch, in_flight: deque):
+        if len(in_flight) >= self.concurrency:
+            await self._complete(in_flight.popleft())
+        in_flight.append((batch, asyncio.create_task(self._embed(batch.texts))))
+
+    # Эмбеддинги пакета с повторами при ошибках API
+    async def _embed(self, texts: list):
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self.retries),
+            wait=wait_random_exponential(multiplier=1, max=30),
+            reraise=True
+        ):
+            with attempt:
+                return await self.chunk.embeddings.aembed_documents(texts)
+
+    # Добавление готового пакета в индекс
+    async def _complete(self, item):
+        batch, task = item
+        vectors = await task
+        if self.db is None:
+            # новый индекс обучается на первых train_size векторах; они копятся сразу
+            # в массиве float32, а не в списках чисел Python (в несколько раз больше памяти)
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if self.train_vectors is None:
+                self.train_vectors = np.empty((self.train_size + self.batch_size, vectors.shape[1]), dtype=np.float32)
+            start = self.train_count
+            self.train_count += len(vectors)
+            self.train_vectors[start:self.train_count] = vectors
+            self.train.append((batch, start, self.train_count))
+            if self.train_count >= self.train_size:
+                await self._add_training()
+            return
+        await asyncio.to_thread(
+            self.db.add_embeddings, list(zip(batch.texts, vectors)), batch.metadatas, batch.ids
+        )
+        self.chunks += len(batch.texts)
+        self._finish(batch.finished)
+        await self._maybe_checkpoint()
+
+    async def _add_training(self):
+        pending, self.train = self.train, []
+        vectors, self.train_vectors = self.train_vectors[:self.train_count], None
+        self.train_count = 0
+        self.db = await asyncio.to_thread(self.chunk.create_store, vectors)
+        for batch, start, end in pending:
+            await asyncio.to_thread(
+                self.db.add_embeddings, list(zip(batch.texts, vectors[start:end])), batch.metadatas, batch.ids
+            )
+            self.chunks += len(batch.texts)
+            self._finish(batch.finished)
+        await self._maybe_checkpoint()
+
+    # Документ записывается в манифест, только когда в индексе все его чанки
+    def _finish(self, finished: list):
+        for name, digest, ids in finished:
+            self.manifest[name] = {'hash': digest, 'ids': ids}
+            self.documents += 1
+            self.since_checkpoint += 1
+
+    async def _maybe_checkpoint(self):
+        if not self.checkpoint_every or self.since_checkpoint < self.checkpoint_every or self.db is None:
+            return
+        self.since_checkpoint = 0
+        await asyncio.to_thread(self.chunk.store.save_checkpoint, self.key, self.db, self.manifest)
+        elapsed = time.monotonic() - self.started
+        print(f'Контрольная точка: документов {self.documents}, чанков {self.chunks}, '
+              f'{self.chunks / elapsed:.0f} чанков/с')
+
+
+# ФУНКЦИЯ: объем обучающей выборки для нового индекса
+def train_size(index_type: str, nlist: int) -> int:
+    return nlist * MIN_POINTS_PER_CENTROID if index_type.startswith('ivf') else 0
+
+
+async def ingest(args):
+    os.environ['BASE_DIR'] = args.base
+    from api import chunks
+
+    chunk = chunks.Chunk()
+    chunk.embeddings = chunk.create_embeddings()
+    try:
+        key = chunks.settings_key()
+        paths = list_documents(args.base, chunks.BASE_PATTERNS)
+        hashes = {name: await asyncio.to_thread(file_hash, path) for name, path in paths.items()}
+        print(f'Документов: {len(paths)}')
+
+        await asyncio.to_thread(chunk.store.acquire)
+        try:
+            ingestor = Ingestor(
+                chunk, chunks.CHUNK_SIZE, chunks.CHUNK_OVERLAP,
+                batch_size=args.batch_size, concurrency=args.concurrency, workers=args.workers,
+                checkpoint_every=args.checkpoint_every, retries=args.retries,
+                train_size=train_size(chunks.INDEX_TYPE, chunks.INDEX_NLIST)
+            )
+            db, manifest = await ingestor.run(key, paths, hashes)
+            name = await asyncio.to_thread(chunk.store.save, key, db, manifest)
+            await asyncio.to_thread(chunk.store.drop_checkpoint, key)
+        finally:
+            chunk.store.release()
+        print(f'Индекс сохранен: {name}, векторов {db.index.ntotal}')
+    finally:
+        await chunk.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Загрузка документов в индекс базы знаний')
+    parser.add_argument('--base', default=os.getenv('BASE_DIR', os.path.join(os.path.dirname(__file__), 'base')))
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help='чанков в запросе эмбеддингов')
+    parser.add_argument('--concurrency', type=int, default=INGEST_CONCURRENCY, help='одновременных запросов')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='процессов для разбиения')
+    parser.add_argument('--checkpoint-every', type=int, default=INGEST_CHECKPOINT_EVERY,
+                        help='документов между контрольными точками')
+    parser.add_argument('--retries', type=int, default=INGEST_RETRIES)
+    args = parser.parse_args()
+    asyncio.run(ingest(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Снимок базы знаний
+#
+# Снимок содержит все, что нужно для поиска по одной версии базы знаний:
+# индекс FAISS, фрагменты в порядке позиций индекса и лексический индекс BM25.
+# После создания снимок не изменяется. При перезагрузке базы новый снимок
+# строится рядом со старым и подменяется одним присваиванием (read-copy-update):
+# запрос берет ссылку на текущий снимок в начале и работает с ней до конца,
+# а старый снимок освобождается, когда его перестает использовать последний запрос.
+
+import glob
+import os
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows: модуля resource нет
+    resource = None
+
+
+class Knowledge:
+    __slots__ = ('db', 'docs', 'lexical', 'version', '__weakref__')
+
+    def __init__(self, db, docs: list, lexical, version: str):
+        self.db = db
+        self.docs = docs
+        self.lexical = lexical
+        self.version = version
+
+    # МЕТОД: номера ближайших фрагментов по эмбеддингу (позиции индекса FAISS)
+    def vector_ids(self, vector, k: int):
+        _, ids = self.db.index.search(np.asarray([vector], dtype=np.float32), k)
+        return [int(i) for i in ids[0] if i >= 0]
+
+
+# ФУНКЦИЯ: подпись каталога базы знаний для отслеживания изменений
+# Возвращает кортеж (имя, размер, время изменения) по всем файлам каталога
+def base_signature(base_dir: str, patterns) -> tuple:
+    paths = sorted(
+        path
+        for pattern in patterns
+        for path in glob.glob(os.path.join(base_dir, '**', pattern), recursive=True)
+    )
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+# ФУНКЦИЯ: память процесса в байтах
+# Возвращает {'rss': текущая, 'peak': пиковая за время жизни процесса}, None - неизвестно
+def memory() -> dict:
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # в Linux - килобайты
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # в Windows пиковая память есть у psutil (peak_wset)
+        return {'rss': info.rss, 'peak': peak if peak is not None else getattr(info, 'peak_wset', None)}
+    try:
+        with open('/proc/self/statm') as file:
+            rss = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        rss = None
+    return {'rss': rss, 'peak': peak}
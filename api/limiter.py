@@ -0,0 +1,202 @@
+# Ограничение скорости обращений к OpenAI
+#
+# Два ведра токенов на модель: запросы в минуту (RPM) и токены в минуту (TPM).
+# Перед запросом вызывающий ждет (asyncio.sleep, без блокировки цикла событий),
+# пока в ведрах не наберется нужное количество. После ответа состояние
+# уточняется по заголовкам x-ratelimit-* от OpenAI.
+#
+# Состояние хранится в памяти процесса или, если задан путь к файлу,
+# в SQLite - тогда лимиты общие для всех воркеров на машине.
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Порядок полей состояния ведер
+FIELDS = ('limit_requests', 'limit_tokens', 'requests', 'tokens', 'updated', 'blocked')
+
+
+# ФУНКЦИЯ: разбор длительности из заголовков OpenAI ("20ms", "1s", "6m0s", "1h2m3.5s")
+# Возвращает секунды
+def parse_duration(value) -> float:
+    if value is None:
+        return 0.0
+    total = 0.0
+    for number, unit in re.findall(r'([\d.]+)(ms|h|m|s)', str(value)):
+        total += float(number) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total
+
+
+class RateLimiter:
+    def __init__(self, name: str, rpm: int, tpm: int, path: str = None):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.state = None
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS limits (name TEXT PRIMARY KEY, '
+                + ', '.join(f'{field} REAL' for field in FIELDS) + ')'
+            )
+
+        # счетчики ожиданий
+        self.waits = 0
+        self.waited = 0.0
+
+    # ---------- хранение состояния ----------
+
+    def _initial(self, now: float) -> dict:
+        return dict(limit_requests=self.rpm, limit_tokens=self.tpm,
+                    requests=self.rpm, tokens=self.tpm, updated=now, blocked=0.0)
+
+    # Выполняет change(state, now) атомарно: в памяти - под блокировкой потока,
+    # в файле - в транзакции BEGIN IMMEDIATE, которая блокирует другие процессы
+    def _transact(self, change):
+        now = time.time()
+        with self.lock:
+            if self.db is None:
+                if self.state is None:
+                    self.state = self._initial(now)
+                return change(self.state, now)
+
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(
+                    f'SELECT {", ".join(FIELDS)} FROM limits WHERE name = ?', (self.name,)
+                ).fetchone()
+                state = dict(zip(FIELDS, row)) if row else self._initial(now)
+                result = change(state, now)
+                self.db.execute(
+                    f'INSERT OR REPLACE INTO limits (name, {", ".join(FIELDS)}) '
+                    f'VALUES (?, {", ".join("?" * len(FIELDS))})',
+                    (self.name, *(state[field] for field in FIELDS))
+                )
+                self.db.execute('COMMIT')
+                return result
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    # ---------- логика ведер ----------
+
+    # пополнение ведер пропорционально прошедшему времени
+    @staticmethod
+    def _refill(state: dict, now: float):
+        elapsed = max(0.0, now - state['updated'])
+        state['requests'] = min(state['limit_requests'],
+                                state['requests'] + elapsed * state['limit_requests'] / 60)
+        state['tokens'] = min(state['limit_tokens'],
+                              state['tokens'] + elapsed * state['limit_tokens'] / 60)
+        state['updated'] = now
+
+    # Попытка забрать 1 запрос и tokens токенов
+    # Возвращает 0, если получилось, иначе время ожидания в секундах
+    def _take(self, tokens: int) -> float:
+        def change(state, now):
+            self._refill(state, now)
+            need = min(tokens, state['limit_tokens'])
+            wait = max(
+                state['blocked'] - now,
+                (1 - state['requests']) * 60 / state['limit_requests'],
+                (need - state['tokens']) * 60 / state['limit_tokens'],
+            )
+            if wait > 0:
+                return wait
+            state['requests'] -= 1
+            state['tokens'] -= need
+            return 0.0
+        return self._transact(change)
+
+    # МЕТОД: ожидание разрешения на запрос
+    #   tokens - оценка числа токенов запроса (промпт + ответ)
+    async def acquire(self, tokens: int = 1):
+        while True:
+            if self.db is None:
+                wait = self._take(tokens)
+            else:
+                wait = await asyncio.to_thread(self._take, tokens)
+            if wait <= 0:
+                return
+            self.waits += 1
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    # МЕТОД: уточнение состояния по заголовкам ответа OpenAI
+    #   headers - заголовки ответа (dict или multidict)
+    async def update(self, headers):
+        if not headers:
+            return
+        headers = {str(k).lower(): v for k, v in headers.items()}
+        if 'x-ratelimit-remaining-requests' not in headers:
+            return
+
+        def number(name):
+            try:
+                return float(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        def change(state, now):
+            self._refill(state, now)
+            for kind in ('requests', 'tokens'):
+                limit = number(f'x-ratelimit-limit-{kind}')
+                remaining = number(f'x-ratelimit-remaining-{kind}')
+                if limit:
+                    state[f'limit_{kind}'] = limit
+                if remaining is not None:
+                    # OpenAI знает точнее: доверяем меньшему из значений
+                    state[kind] = min(state[kind], remaining)
+                    if remaining <= 0:
+                        reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                        state['blocked'] = max(state['blocked'], now + reset)
+        if self.db is None:
+            self._transact(change)
+        else:
+            # транзакция SQLite может ждать другие процессы - не в цикле событий
+            await asyncio.to_thread(self._transact, change)
+
+    # МЕТОД: текущее состояние ведер
+    def stats(self) -> dict:
+        def change(state, now):
+            self._refill(state, now)
+            return {field: state[field] for field in FIELDS if field != 'updated'}
+        result = self._transact(change)
+        result.update(waits=self.waits, waited=round(self.waited, 3))
+        return result
+
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+            self.db = None
+
+
+# Набор ограничителей по моделям: у каждой модели OpenAI свои лимиты
+class RateLimits:
+    def __init__(self, rpm: int, tpm: int, path: str = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.limiters = {}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __call__(self, model: str) -> RateLimiter:
+        if model not in self.limiters:
+            self.limiters[model] = RateLimiter(model, self.rpm, self.tpm, self.path)
+        return self.limiters[model]
+
+    def stats(self) -> dict:
+        return {model: limiter.stats() for model, limiter in self.limiters.items()}
+
+    def close(self):
+        for limiter in self.limiters.values():
+            limiter.close()
@@ -1,11 +1,53 @@
-from fastapi import FastAPI  # Импортируем FastAPI для создания приложения
+import asyncio  # Для фоновой загрузки базы знаний
+import os  # Для чтения настроек из переменных окружения
+import secrets  # Для сравнения токена администратора
+from contextlib import asynccontextmanager  # Для описания жизненного цикла приложения
+import orjson  # Быстрая сериализация событий SSE
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, File, Form, UploadFile  # Импортируем FastAPI для создания приложения
 from pydantic import BaseModel  # Импортируем BaseModel для работы со структурами данных
 from api.chunks import Chunk  # Импортируем модуль для взаимодействия с OpenAI (или другим API)
+from api.ann import describe  # Описание индекса FAISS для статистики
 from fastapi.middleware.cors import CORSMiddleware  # Для настройки CORS (междоменного взаимодействия)
-from fastapi.responses import JSONResponse  # Для отправки кастомных JSON-ответов
+from fastapi.responses import JSONResponse, StreamingResponse, Response  # Для отправки кастомных JSON-ответов и потоков
+
+# Создаем объект для взаимодействия с OpenAI (или другой логикой)
+chunk = Chunk()
+
+# Сколько секунд запрос ждет готовности базы знаний, прежде чем получить 503
+READY_TIMEOUT = float(os.getenv('READY_TIMEOUT', '5'))
+
+# Пакетные запросы: число одновременных запросов по умолчанию и пределы
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '32'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+
+# Предельный размер загружаемого изображения для распознавания, байт
+OCR_MAX_BYTES = int(os.getenv('OCR_MAX_BYTES', str(20 * 1024 * 1024)))
+# Запас на поля формы и границы multipart сверх размера изображения, байт
+OCR_FORM_OVERHEAD = 64 * 1024
+
+# Перезагрузка базы знаний: период опроса каталога (0 - не следить) и токен администратора
+RELOAD_INTERVAL = float(os.getenv('RELOAD_INTERVAL', '10'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Жизненный цикл приложения: загрузка базы знаний при старте, остановка при завершении
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общий пул соединений к OpenAI
+    chunk.open()
+    # База загружается в фоне, чтобы /healthz отвечал сразу после старта процесса
+    tasks = [asyncio.create_task(chunk.start())]
+    # Изменения в каталоге базы знаний подхватываются без перезапуска
+    if RELOAD_INTERVAL > 0:
+        tasks.append(asyncio.create_task(chunk.watch(RELOAD_INTERVAL)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await chunk.close()
 
 # Создаем объект FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Добавляем middleware для настройки CORS (междоменного взаимодействия)
 app.add_middleware(
@@ -16,8 +58,104 @@ app.add_middleware(
     allow_headers=["*"]  # Разрешаем любые заголовки
 )
 
-# Создаем объект для взаимодействия с OpenAI (или другой логикой)
-chunk = Chunk()
+# Ограничение размера тела запроса на заданном пути (ASGI middleware)
+# Форма multipart разбирается до вызова обработчика и сохраняется во временный файл,
+# поэтому размер проверяется раньше: по Content-Length до чтения тела, а для тела
+# без Content-Length (chunked) - по мере получения, чтение прерывается на пределе.
+class BodyLimit:
+    def __init__(self, app, path: str, limit: int):
+        self.app = app
+        self.path = path
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+
+        detail = f'Тело запроса больше {self.limit} байт'
+        length = dict(scope['headers']).get(b'content-length')
+        if length is not None and length.isdigit() and int(length) > self.limit:
+            response = JSONResponse(status_code=413, content={'detail': detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited, send)
+
+app.add_middleware(BodyLimit, path='/api/image_ocr_file', limit=OCR_MAX_BYTES + OCR_FORM_OVERHEAD)
+
+# Зависимость: запрос к базе знаний выполняется только после ее загрузки
+async def knowledge_ready():
+    if not await chunk.wait_ready(READY_TIMEOUT):
+        detail = 'База знаний не загружена' if chunk.error else 'База знаний загружается'
+        raise HTTPException(status_code=503, detail=detail, headers={'Retry-After': '5'})
+
+# Зависимость: доступ к административным эндпоинтам по заголовку X-Admin-Token
+# Если ADMIN_TOKEN не задан, административные эндпоинты отключены
+def admin_only(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail='Not Found')
+    if not secrets.compare_digest(x_admin_token or '', ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='Неверный токен администратора')
+
+# Выполнение обработчика с отменой при отключении клиента
+#   request - входящий запрос
+#   coro    - корутина обработки
+# Если клиент отключился раньше, чем готов ответ, корутина отменяется: при объединении
+# одинаковых запросов (SingleFlight) работа продолжится, только если ее ждет кто-то еще.
+async def until_disconnect(request: Request, coro):
+    async def disconnected():
+        while (await request.receive())['type'] != 'http.disconnect':
+            pass
+
+    work = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not work.done():
+        work.cancel()
+        await asyncio.gather(work, return_exceptions=True)
+        return None
+    return work.result()
+
+# Потоковый ответ в формате Server-Sent Events
+#   request - входящий запрос (для отслеживания отключения клиента)
+#   tokens  - асинхронный генератор фрагментов текста
+# Каждый фрагмент отправляется событием `data: {"text": ...}`, в конце - событие `done`
+# с расходом токенов.
+# Если клиент отключился, генератор закрывается и запрос к OpenAI прерывается.
+def sse_response(request: Request, tokens):
+    async def events():
+        try:
+            usage = {}
+            async for token in tokens:
+                if await request.is_disconnected():
+                    break
+                if isinstance(token, dict):
+                    usage = token  # расход токенов приходит последним
+                    continue
+                yield b'data: ' + orjson.dumps({'text': token}) + b'\n\n'
+            else:
+                yield b'event: done\ndata: ' + orjson.dumps({'usage': usage}) + b'\n\n'
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # Определяем модель данных для пользователя
 class Item(BaseModel):
@@ -46,6 +184,11 @@ class ModelRequest(BaseModel):
     temperature: float = 0.5  # Температура для контроля генерации текста
     format: dict = None  # Форматирование ответа (необязательно)
 
+# Определяем модель данных для пакета запросов к OpenAI
+class ModelBatch(BaseModel):
+    items: list[ModelRequest]  # Запросы в порядке, в котором нужны ответы
+    concurrency: int = None  # Сколько запросов выполнять одновременно (необязательно)
+
 # Главная страница
 @app.get("/")
 def root():
@@ -56,6 +199,20 @@ def root():
 def about():
     return {"message": "Страница с описанием проекта"}  # Текстовое описание
 
+# Проверка жизнеспособности процесса
+@app.get('/healthz')
+def healthz():
+    return {'status': 'ok'}
+
+# Проверка готовности к приему трафика (для балансировщика нагрузки)
+@app.get('/readyz')
+def readyz():
+    if chunk.error is not None:
+        return JSONResponse(status_code=503, content={'status': 'error', 'detail': repr(chunk.error)})
+    if not chunk.ready.is_set():
+        return JSONResponse(status_code=503, content={'status': 'loading'})
+    return {'status': 'ready'}
+
 # Получение информации о пользователе по ID
 @app.get("/users/{id}")
 def users(id: int):
@@ -73,10 +230,48 @@ def post_add(item: ModelCalc):
     return {'result': result}  # Возвращаем результат сложения
 
 # Асинхронная обработка текста через OpenAI
-@app.post('/api/get_answer_async')
-async def get_answer_async(question: ModelAnswer):
-    answer = await chunk.get_answer_async(query=question.text)  # Асинхронный вызов API
-    return {'message': answer}  # Возвращаем результат
+@app.post('/api/get_answer_async', dependencies=[Depends(knowledge_ready)])
+async def get_answer_async(question: ModelAnswer, request: Request):
+    answer = await until_disconnect(request, chunk.answer(query=question.text))  # Асинхронный вызов API
+    if answer is None:
+        return Response(status_code=499)  # Клиент отключился, отвечать некому
+    return answer  # Возвращаем результат и расход токенов
+
+# Потоковый ответ на вопрос к базе знаний (SSE)
+@app.post('/api/get_answer_stream', dependencies=[Depends(knowledge_ready)])
+async def get_answer_stream(question: ModelAnswer, request: Request):
+    return sse_response(request, chunk.get_answer_stream(query=question.text))
+
+# Статистика кэшей ответов и эмбеддингов
+@app.get('/api/cache/stats')
+def cache_stats():
+    return {
+        'answers': chunk.cache.stats(),
+        'embeddings': chunk.embeddings.stats() if chunk.embeddings else None,
+        'ocr': chunk.ocr_cache.stats(),
+        'single_flight': chunk.flights.stats(),
+        'index': describe(chunk.db.index) if chunk.db else None
+    }
+
+# Перезагрузка базы знаний без остановки сервиса
+# Новый индекс строится в фоне, текущий продолжает отвечать до подмены.
+# Отключение клиента не прерывает перезагрузку.
+@app.post('/api/admin/reload', dependencies=[Depends(admin_only)])
+async def admin_reload():
+    try:
+        return await asyncio.shield(chunk.reload())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Ошибка перезагрузки: {e}')
+
+# Статистика перезагрузок: версия базы, число живых снимков, память процесса
+@app.get('/api/admin/reload', dependencies=[Depends(admin_only)])
+def admin_reload_stats():
+    return chunk.reload_stats()
+
+# Состояние ограничителей скорости обращений к OpenAI
+@app.get('/api/limits')
+def limits():
+    return chunk.limits.stats()
 
 # Обработка распознавания изображений для telegram bot
 @app.post('/api/image_ocr')
@@ -87,13 +282,55 @@ async def post_ocr(question: ModelOcr):
     })
     return {'message': answer}  # Возвращаем результат
 
+# Распознавание изображения, загруженного файлом (multipart/form-data).
+# Картинка приходит в бинарном виде, уменьшается и кодируется в base64 один раз - в Chunk.
+@app.post('/api/image_ocr_file')
+async def post_ocr_file(
+    file: UploadFile = File(...),  # Файл изображения
+    text: str = Form('Распознай текст на изображении'),  # Текст для роли 'user'
+    file_unique_id: str = Form(None)  # Идентификатор файла в Telegram (для кэша повторов)
+):
+    # читается не больше предела + 1 байт: больший файл целиком в память не попадает
+    data = await file.read(OCR_MAX_BYTES + 1)
+    await file.close()
+    if len(data) > OCR_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f'Изображение больше {OCR_MAX_BYTES} байт')
+    answer = await chunk.ocr_file(data, text, file_unique_id)
+    return {'message': answer}  # Возвращаем результат
+
 # Асинхронное обращение к OpenAI с дополнительными параметрами
 @app.post('/api/request')
-async def post_request(question: ModelRequest):
-    answer = await chunk.request(
+async def post_request(question: ModelRequest, request: Request):
+    answer = await until_disconnect(request, chunk.complete(
         system=question.system,  # Передаем системное сообщение
         user=question.user,  # Передаем пользовательский запрос
         temp=question.temperature,  # Контролируем температуру генерации текста
         format=question.format  # Указываем формат ответа (если есть)
-    )
-    return {'message': answer}  # Возвращаем результат
+    ))
+    if answer is None:
+        return Response(status_code=499)  # Клиент отключился, отвечать некому
+    return answer  # Возвращаем результат и расход токенов
+
+# Потоковое обращение к OpenAI (SSE)
+@app.post('/api/request_stream')
+async def post_request_stream(question: ModelRequest, request: Request):
+    return sse_response(request, chunk.request_stream(
+        system=question.system,
+        user=question.user,
+        temp=question.temperature,
+        format=question.format
+    ))
+
+# Пакет запросов к OpenAI с ограничением числа одновременных запросов.
+# Ответы возвращаются в порядке запросов, ошибка одного запроса не мешает остальным.
+@app.post('/api/request/batch')
+async def post_request_batch(batch: ModelBatch, request: Request):
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'Не более {BATCH_MAX_ITEMS} запросов в пакете')
+    concurrency = min(max(batch.concurrency or BATCH_CONCURRENCY, 1), BATCH_MAX_CONCURRENCY)
+    results = await until_disconnect(request, chunk.request_batch(
+        [item.model_dump() for item in batch.items], concurrency
+    ))
+    if results is None:
+        return Response(status_code=499)  # Клиент отключился, отвечать некому
+    return {'results': results}
@@ -0,0 +1,45 @@
+# Запуск API в нескольких процессах
+#
+# Запуск:
+#   python -m api.serve --workers 4 --host 0.0.0.0 --port 8000
+#
+# Перед запуском воркеров индекс базы знаний строится (или обновляется) один раз
+# в этом процессе и сохраняется на диск. Воркеры стартуют в режиме INDEX_MMAP:
+# каждый отображает готовый индекс в память только для чтения, поэтому страницы
+# с векторами общие для всех процессов и память почти не растет с числом воркеров.
+# При изменении базы знаний новый индекс строит первый заметивший это воркер,
+# остальные дожидаются его под файловой блокировкой и читают готовый.
+
+import argparse
+import asyncio
+import os
+
+import uvicorn
+
+
+# ФУНКЦИЯ: построение индекса до запуска воркеров
+async def prebuild():
+    from api.chunks import Chunk
+    chunk = Chunk()
+    try:
+        knowledge = await chunk.base_load()
+        print(f'Индекс базы знаний готов: версия {knowledge.version}, фрагментов {len(knowledge.docs)}')
+    finally:
+        await chunk.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запуск API в нескольких процессах')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    # воркеры наследуют окружение и читают индекс через mmap
+    os.environ['INDEX_MMAP'] = '1'
+    asyncio.run(prebuild())
+    uvicorn.run('api.main:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Объединение одинаковых одновременных вызовов (single-flight)
+#
+# Первый вызов с данным ключом запускает работу отдельной задачей, остальные
+# одновременные вызовы с тем же ключом ждут ее результат, не выполняя работу
+# повторно. Исключение получают все ожидающие. Отмена одного ожидающего
+# (например, отключился клиент первого запроса) не прерывает работу для
+# остальных; работа отменяется, только когда ее результат больше никому не нужен.
+
+import asyncio
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        # счетчики: запущено работ и присоединилось к уже идущим
+        self.started = 0
+        self.shared = 0
+
+    # МЕТОД: выполнение работы с объединением одинаковых вызовов
+    #   key  - ключ запроса (хэшируемый)
+    #   work - функция без аргументов, возвращающая корутину
+    # Возвращает результат работы
+    async def do(self, key, work):
+        call = self.calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(work()))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # ожидающих не осталось: новые вызовы начнут работу заново
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self.calls), 'started': self.started, 'shared': self.shared}
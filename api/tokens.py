@@ -0,0 +1,72 @@
+# Подсчет токенов и сборка контекста в пределах бюджета
+#
+# Кодировщик tiktoken создается один раз на модель, число токенов
+# часто повторяющихся фрагментов базы знаний кэшируется.
+
+import functools
+
+import tiktoken
+
+# Запас токенов на ответ модели при оценке запроса для ограничителя скорости
+COMPLETION_RESERVE = 256
+
+# Служебные токены чат-формата: на каждое сообщение и на начало ответа
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Фрагмент короче этого числа токенов не обрезается, а отбрасывается
+MIN_PIECE_TOKENS = 50
+
+
+# ФУНКЦИЯ: кодировщик tiktoken для модели
+@functools.lru_cache(maxsize=None)
+def encoder(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+# ФУНКЦИЯ: число токенов в тексте
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str) -> int:
+    return len(encoder(model).encode(text, disallowed_special=()))
+
+
+# ФУНКЦИЯ: число токенов в списке сообщений LangChain
+def count_messages(messages, model: str) -> int:
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(str(message.content), model) for message in messages
+    ) + TOKENS_PER_REPLY
+
+
+# ФУНКЦИЯ: сборка контекста
+#   texts  - найденные фрагменты в порядке релевантности
+#   budget - бюджет токенов на контекст
+# Повторяющиеся фрагменты отбрасываются, последний не поместившийся фрагмент
+# обрезается по границе токена.
+# Возвращает (контекст, число токенов контекста)
+def assemble_context(texts, budget: int, model: str):
+    seen = set()
+    parts = []
+    used = 0
+    for text in texts:
+        norm = ' '.join(text.split())
+        if not norm or norm in seen:
+            continue
+        seen.add(norm)
+
+        separator = 1 if parts else 0
+        tokens = count_tokens(text, model)
+        if used + separator + tokens <= budget:
+            parts.append(text)
+            used += separator + tokens
+            continue
+
+        rest = budget - used - separator
+        if rest >= MIN_PIECE_TOKENS:
+            enc = encoder(model)
+            parts.append(enc.decode(enc.encode(text, disallowed_special=())[:rest]))
+            used += separator + rest
+        break
+    return '\n'.join(parts), used
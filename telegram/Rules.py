@@ -1,11 +1,15 @@
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from telegram.ext import ContextTypes
+from telegram.ext import CommandHandler, MessageHandler, filters
 from telegram import Update                    
 from dotenv import load_dotenv
+from launcher import build, run
+import aiohttp
+import asyncio
+import math
 import os
 import requests
-import aiohttp
+from api_client import api, ApiError
+from ratelimit import RateLimiter, RATE_LIMIT_DB
 
 # загружаем переменные окружения
 load_dotenv()
@@ -13,6 +17,19 @@ load_dotenv()
 # токен бота
 TOKEN = os.getenv('TG_TOKEN')
 
+# ограничение обращений пользователя: RATE_LIMIT (3) за скользящее окно RATE_WINDOW (60 с);
+# с RATE_LIMIT_DB лимит общий для всех процессов бота
+limiter = RateLimiter(path=RATE_LIMIT_DB or None)
+
+# ФУНКЦИЯ: длина окна лимита для сообщения пользователю ("в минуту", "за 5 мин", "за 30 с")
+#   seconds - длина окна, с
+def window_text(seconds: float) -> str:
+    if seconds == 60:
+        return 'в минуту'
+    if seconds % 60 == 0:
+        return f'за {int(seconds // 60)} мин'
+    return f'за {seconds:g} с'
+
 # функция-обработчик команды /start
 async def start(update, context):
     # сообщение пользователю
@@ -24,59 +41,49 @@ async def status(update, context):
     # получение ID пользователя
     user_id = update.message.from_user.id
 
-    # проверяем наличие пользователя в базе
-    if user_id in context.bot_data:
-        remaining_requests = context.bot_data[user_id]
-    else:
-        remaining_requests = 3  # если пользователь еще не делал запросов
+    # сколько обращений осталось в текущем окне
+    remaining_requests = await limiter.remaining(user_id)
 
     # отправляем сообщение пользователю
     await update.message.reply_text(f"Осталось запросов: {remaining_requests}")
 
 # функция-обработчик текстовых сообщений
 async def text(update, context):
-    # создание счётчика у пользователя
     user_id = update.message.from_user.id
-    if user_id not in context.bot_data:
-        context.bot_data[user_id] = 3
+
+    # обращение учитывается до запроса к API: обновления обрабатываются
+    # параллельно, и несколько сообщений пользователя не должны пройти
+    # проверку одновременно
+    wait = await limiter.take(user_id)
+    if wait > 0:
+        await update.message.reply_text(
+            f'Ваш лимит обращений: {limiter.limit} {window_text(limiter.window)}. На текущий момент исчерпан! '
+            f'Повторите через {math.ceil(wait)} с'
+        )
+        return
 
     # обращение к API база Simble
-    if context.bot_data[user_id] > 0:
-        param = {
-            'text': update.message.text
-        }    
-        async with aiohttp.ClientSession() as session:
-            async with session.post('http://127.0.0.1:8000/api/get_answer_async', json=param) as response:
-                # получение ответа от API
-                answer = await response.json()
-                # уменьшаем количество оставшихся запросов
-                context.bot_data[user_id] -= 1
-                # добавление информации о количестве оставшихся запросов в сообщение пользователю
-                # answer['message'] += f'\n-\nУ вас осталось обращений: {context.bot_data[user_id]}'
-                await update.message.reply_text(answer['message'])
-    else:
-        await update.message.reply_text('Ваш лимит 3 обращения в минуту. На текущий момент исчерпан!')
-
-# Функция срабатывает через заданный интервал времени
-async def task(context: ContextTypes.DEFAULT_TYPE):
-    # сброс счетчиков у всех пользователей
-    if context.bot_data:
-        for key in context.bot_data:
-            context.bot_data[key] = 3
-        print('Запросы пользователей обновлены')
+    try:
+        # получение ответа от API (общая сессия клиента)
+        message = await api.get_answer(update.message.text)
+    except ApiError as e:
+        # неудачный запрос не расходует лимит
+        await limiter.give_back(user_id)
+        await update.message.reply_text(f'Ошибка API: {e.detail}')
+        return
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # API недоступен или не ответил за API_TIMEOUT и после повторов клиента
+        await limiter.give_back(user_id)
+        await update.message.reply_text(f'Ошибка соединения с API: {e or "сервер не ответил вовремя"}')
+        return
+    # добавление информации о количестве оставшихся запросов в сообщение пользователю
+    # message += f'\n-\nУ вас осталось обращений: {await limiter.remaining(user_id)}'
+    await update.message.reply_text(message)
 
 # функция "Запуск бота"
 def main():
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
-
-    # запуск планировщика
-    schedule = application.job_queue
-    if not schedule:
-        schedule = application.job_queue = application.create_job_queue()  # Создаем `JobQueue`, если не создан
-
-    interval = 60  # интервал 60 секунд = 1 минута
-    schedule.run_repeating(task, interval=interval) 
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler('start', start))
@@ -88,9 +95,7 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT, text))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
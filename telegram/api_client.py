@@ -0,0 +1,161 @@
+# Клиент API базы знаний (api/main.py) для ботов
+#
+# Одна сессия aiohttp с пулом keep-alive соединений на весь процесс бота:
+# открывается при запуске приложения и закрывается при остановке (launcher.py).
+# Запросы повторяются, только если соединение не установлено (ошибка или тайм-аут
+# подключения) или получен ответ 502/503/504, с экспоненциальной задержкой (для 503
+# учитывается заголовок Retry-After). Запросы к модели не идемпотентны: после общего
+# тайм-аута или обрыва уже отправленного запроса повтор стоил бы еще одного вызова
+# модели, поэтому ошибка сразу передается боту.
+# JSON сериализуется и разбирается через orjson.
+#
+# Подключение в боте:
+#   from api_client import api
+#   answer = await api.get_answer(update.message.text)
+
+import asyncio
+import os
+import random
+from typing import TypedDict
+
+import aiohttp
+import orjson
+
+# Адрес API и настройки клиента
+API_URL = os.getenv('API_URL', 'http://127.0.0.1:8000')
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '120'))
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '5'))
+API_RETRIES = int(os.getenv('API_RETRIES', '3'))
+API_BACKOFF = float(os.getenv('API_BACKOFF', '0.5'))
+API_MAX_CONNECTIONS = int(os.getenv('API_MAX_CONNECTIONS', '100'))
+
+# Ответы и ошибки, после которых запрос стоит повторить: запрос до API не дошел
+RETRY_STATUSES = {502, 503, 504}
+RETRY_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+# Максимальная задержка между попытками, с
+MAX_BACKOFF = 10.0
+
+
+class Usage(TypedDict, total=False):
+    prompt_tokens: int
+    completion_tokens: int
+    cached: bool
+
+
+class Answer(TypedDict):
+    message: str
+    usage: Usage
+
+
+# Ошибка API: код ответа и описание из поля detail
+class ApiError(Exception):
+    def __init__(self, status: int, detail):
+        super().__init__(f'{status}: {detail}')
+        self.status = status
+        self.detail = detail
+
+
+class ApiClient:
+    def __init__(self, base_url: str = API_URL, timeout: float = API_TIMEOUT,
+                 retries: int = API_RETRIES, backoff: float = API_BACKOFF,
+                 max_connections: int = API_MAX_CONNECTIONS):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.session = None
+
+    # МЕТОД: создание общей сессии
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=API_CONNECT_TIMEOUT),
+                json_serialize=lambda value: orjson.dumps(value).decode()
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # МЕТОД: POST-запрос к API
+    #   path    - путь эндпоинта
+    #   json    - тело запроса (словарь)
+    #   data    - тело multipart (aiohttp.FormData); такой запрос не повторяется,
+    #             так как поток данных нельзя прочитать второй раз
+    # Возвращает разобранный JSON ответа
+    async def post(self, path: str, json: dict = None, data=None) -> dict:
+        if self.session is None:
+            raise RuntimeError('ApiClient не запущен: вызовите start() при запуске приложения')
+        url = f'{self.base_url}{path}'
+        body = orjson.dumps(json) if json is not None else data
+        headers = {'Content-Type': 'application/json'} if json is not None else None
+        attempts = 1 + (self.retries if data is None else 0)
+
+        for attempt in range(attempts):
+            retry_after = None
+            try:
+                async with self.session.post(url, data=body, headers=headers) as response:
+                    if response.status not in RETRY_STATUSES or attempt == attempts - 1:
+                        return await self._result(response)
+                    retry_after = response.headers.get('Retry-After')
+            except RETRY_ERRORS:
+                if attempt == attempts - 1:
+                    raise
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    @staticmethod
+    async def _result(response) -> dict:
+        payload = await response.read()
+        try:
+            result = orjson.loads(payload) if payload else {}
+        except orjson.JSONDecodeError:
+            result = {'detail': payload.decode(errors='replace')}
+        if response.status >= 400:
+            raise ApiError(response.status, result.get('detail') if isinstance(result, dict) else result)
+        return result
+
+    # задержка перед повтором: экспоненциальная со случайным разбросом
+    def _delay(self, attempt: int, retry_after=None) -> float:
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+        return min(self.backoff * 2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1.0)
+
+    # ---------- эндпоинты ----------
+
+    # МЕТОД: ответ на вопрос по базе знаний
+    async def answer(self, text: str) -> Answer:
+        return await self.post('/api/get_answer_async', json={'text': text})
+
+    async def get_answer(self, text: str) -> str:
+        return (await self.answer(text))['message']
+
+    # МЕТОД: запрос к модели
+    #   system      - системное сообщение
+    #   user        - запрос пользователя
+    #   temperature - температура модели
+    #   format      - формат ответа (например, {"type": "json_object"})
+    async def request(self, system: str, user: str, temperature: float = 0.5, format: dict = None) -> str:
+        param = {'system': system, 'user': user, 'temperature': temperature}
+        if format is not None:
+            param['format'] = format
+        return (await self.post('/api/request', json=param))['message']
+
+    # МЕТОД: распознавание изображения
+    #   content - байты или поток (например, тело ответа при скачивании из Telegram)
+    async def image_ocr_file(self, text: str, file_unique_id: str, content) -> str:
+        data = aiohttp.FormData()
+        data.add_field('text', text)
+        data.add_field('file_unique_id', file_unique_id)
+        data.add_field('file', content, filename='photo.jpg', content_type='image/jpeg')
+        return (await self.post('/api/image_ocr_file', data=data))['message']
+
+
+# Общий клиент процесса бота
+api = ApiClient()
+
@@ -1,13 +1,14 @@
 # Пример синхронного обращения к API
 
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import CommandHandler, MessageHandler, filters
 from telegram.ext import ContextTypes
 from telegram import Update                    
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 import requests
-import aiohttp
+from api_client import api, ApiError
 
 # загружаем переменные окружения
 load_dotenv()
@@ -24,24 +25,20 @@ async def start(update, context):
 # функция-обработчик текстовых сообщений
 async def text(update, context):
 
-    # обращение к API база Rules.txt
-    param = {
-        'text': update.message.text
-    }    
-    async with aiohttp.ClientSession() as session:
-        async with session.post('http://127.0.0.1:8000/api/get_answer_async', json = param) as response:
+    # обращение к API база Rules.txt (общая сессия клиента)
+    try:
+        message = await api.get_answer(update.message.text)
+    except ApiError as e:
+        message = f'Ошибка API: {e.detail}'
 
-            # получение ответа от API
-            answer = await response.json()
-
-            # ответ пользователю
-            await update.message.reply_text(answer['message'])
+    # ответ пользователю
+    await update.message.reply_text(message)
 
 # функция "Запуск бота"
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler("start", start))
@@ -50,9 +47,7 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT, text))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
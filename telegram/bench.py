@@ -0,0 +1,418 @@
+# Нагрузочные замеры ботов
+#
+# Запуск (из каталога telegram):
+#   python bench.py webhook --updates 20000 --rate 2000
+#   python bench.py webhook --replay updates.jsonl --rate 1000 --reply
+#   python bench.py webhook --updates 5000 --rate 2000 --queue 100 --workers 8 --delay 0.05
+#   python bench.py state --users 10000 --messages 20
+#
+# webhook - прием обновлений через вебхук.
+# Локальная заглушка Telegram играет обе роли настоящего сервера:
+#   - отвечает на вызовы Bot API (getMe, setWebhook, sendMessage и т. д.);
+#   - доставляет обновления на вебхук бота с заданной скоростью, не больше
+#     --connections запросов одновременно, и при ответе 503 повторяет доставку
+#     через Retry-After, как это делает Telegram.
+# Бот запускается отдельным процессом через launcher.py в режиме вебхука. Обработчик
+# ждет --delay секунд (имитация ожидания API), а с --reply отвечает sendMessage
+# с номером обновления.
+#
+# Выводятся скорость приема и обработки, задержка доставки (POST на вебхук),
+# с --reply - задержка полного цикла (от первой попытки доставки до ответа
+# пользователю), число повторов из-за заполненной очереди. Обновления для
+# --replay - файл JSON Lines, по одному объекту Update в строке (например,
+# сохраненные ответы getUpdates).
+#
+# state - данные игроков game2.py в SqlitePersistence: память на пользователя
+# (запись GameState против прежнего словаря со списками), скорость отложенной
+# записи в SQLite, восстановление после перезапуска и выгрузка неактивных.
+
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+import orjson
+from aiohttp import web
+
+TOKEN = '123456:BENCH'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Выгрузка неактивных игроков не срабатывает во время замера
+STATE_IDLE_NEVER = float('inf')
+
+
+# ФУНКЦИЯ: синтетическое текстовое обновление
+#   update_id - номер обновления
+#   users     - число разных пользователей (чатов)
+def synthetic_update(update_id: int, users: int) -> dict:
+    user = {'id': 1000 + update_id % users, 'is_bot': False, 'first_name': 'Bench', 'language_code': 'ru'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private', 'first_name': 'Bench'},
+            'from': user,
+            'text': 'Какие исключения предусмотрены в страховом договоре?',
+        },
+    }
+
+
+# ФУНКЦИЯ: чтение записанных обновлений (номера обновлений переназначаются по порядку)
+def load_updates(path: str, limit: int) -> list:
+    updates = []
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                update = orjson.loads(line)
+                update['update_id'] = len(updates)
+                updates.append(update)
+            if len(updates) == limit:
+                break
+    return updates
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float('nan')
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+# Заглушка Telegram: Bot API и доставка обновлений на вебхук
+class FakeTelegram:
+    def __init__(self):
+        self.webhook = None
+        self.secret = None
+        self.registered = asyncio.Event()
+        self.sent = {}       # номер обновления -> время первой попытки доставки
+        self.replied = {}    # номер обновления -> время ответа бота
+        self.done = asyncio.Event()
+        self.expected = 0
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.bot_api)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    # вызовы Bot API от бота
+    async def bot_api(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getme':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'setwebhook':
+            self.webhook = params['url']
+            self.secret = params.get('secret_token')
+            self.registered.set()
+            result = True
+        elif method == 'sendmessage':
+            update_id = int(params['text'])
+            self.replied.setdefault(update_id, time.perf_counter())
+            if len(self.replied) >= self.expected:
+                self.done.set()
+            result = {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'text': params['text'],
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    # МЕТОД: доставка обновлений на вебхук с заданной скоростью
+    # Возвращает задержки доставки (с) и число повторов после 503
+    async def replay(self, updates: list, rate: float, connections: int):
+        self.expected = len(updates)
+        limit = asyncio.Semaphore(connections)
+        latencies = []
+        stats = {'retries': 0, 'errors': 0}
+        headers = {SECRET_HEADER: self.secret, 'Content-Type': 'application/json'}
+
+        async def deliver(session, update):
+            body = orjson.dumps(update)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    self.sent.setdefault(update['update_id'], start)
+                    async with session.post(self.webhook, data=body, headers=headers) as response:
+                        await response.read()
+                        if response.status == 200:
+                            latencies.append(time.perf_counter() - start)
+                            return
+                        if response.status != 503:
+                            stats['errors'] += 1
+                            return
+                        retry_after = float(response.headers.get('Retry-After', 1))
+                    stats['retries'] += 1
+                    await asyncio.sleep(retry_after)
+            finally:
+                limit.release()
+
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            started = time.perf_counter()
+            for i, update in enumerate(updates):
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await limit.acquire()
+                tasks.append(asyncio.create_task(deliver(session, update)))
+            await asyncio.gather(*tasks)
+            delivered = time.perf_counter() - started
+
+            # запрос с неверным секретом должен быть отклонен
+            async with session.post(self.webhook, data=b'{}', headers={SECRET_HEADER: 'wrong'}) as response:
+                stats['forbidden'] = response.status
+        return started, delivered, latencies, stats
+
+
+# Процесс бота: launcher.py в режиме вебхука
+# Обработчик ждет --delay секунд (имитация обращения к API) и с --reply
+# отвечает пользователю номером обновления
+def bot(args):
+    from telegram.ext import MessageHandler, filters
+    from launcher import build, run
+
+    async def handle(update, context):
+        if args.delay:
+            await asyncio.sleep(args.delay)
+        if args.reply:
+            await context.bot.send_message(update.effective_chat.id, str(update.update_id))
+
+    application = build(TOKEN)
+    application.add_handler(MessageHandler(filters.ALL, handle))
+    run(application)
+
+
+# ФУНКЦИЯ: статистика вебхука бота (/healthz); ждет запуска сервера
+async def health(url: str, timeout: float = 30.0) -> dict:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return await response.json()
+            except aiohttp.ClientConnectionError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError('Бот не запустился')
+
+
+# ФУНКЦИЯ: ожидание обработки всех обновлений
+# Возвращает статистику вебхука и время окончания обработки
+async def wait_processed(url: str, total: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = await health(url)
+        finished = time.perf_counter()
+        if stats['processed'] + stats['errors'] >= total or time.monotonic() > deadline:
+            return stats, finished
+        await asyncio.sleep(0.05)
+
+
+async def bench_webhook(args):
+    if args.replay:
+        updates = load_updates(args.replay, args.updates)
+    else:
+        updates = [synthetic_update(i, args.users) for i in range(args.updates)]
+    total = len(updates)
+
+    telegram = FakeTelegram()
+    await telegram.start()
+    env = {
+        **os.environ,
+        'BOT_MODE': 'webhook',
+        'BOT_API_URL': telegram.url,
+        'WEBHOOK_URL': f'http://127.0.0.1:{args.port}/telegram',
+        'WEBHOOK_PORT': str(args.port),
+        'WEBHOOK_QUEUE': str(args.queue),
+        'WEBHOOK_WORKERS': str(args.workers),
+        'BOT_CONNECTIONS': str(args.bot_connections),
+        'PYTHONUNBUFFERED': '1',
+    }
+    command = [sys.executable, os.path.abspath(__file__), 'bot', '--delay', str(args.delay)]
+    if args.reply:
+        command.append('--reply')
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    healthz = f'http://127.0.0.1:{args.port}/healthz'
+    try:
+        await asyncio.wait_for(telegram.registered.wait(), 30)
+        await health(healthz)
+
+        started, delivered, latencies, stats = await telegram.replay(updates, args.rate, args.connections)
+        webhook, finished = await wait_processed(healthz, total, args.timeout)
+        if args.reply:
+            try:
+                await asyncio.wait_for(telegram.done.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(30)
+        await telegram.stop()
+
+    print(f'обновлений: {total}, заданная скорость: {args.rate:.0f}/с, соединений: {args.connections}, '
+          f'очередь: {args.queue}, обработчиков: {args.workers}, задержка обработчика: {args.delay * 1000:.0f} мс')
+    print(f'прием:      {total / delivered:8.0f} обн./с  за {delivered:.2f} с, '
+          f'доставка p50 {percentile(latencies, 50) * 1000:.1f} мс, p99 {percentile(latencies, 99) * 1000:.1f} мс')
+    print(f'обработка:  {webhook["processed"] / (finished - started):8.0f} обн./с  '
+          f'обработано {webhook["processed"]}/{total}, ошибок {webhook["errors"]}')
+    if args.reply:
+        e2e = [telegram.replied[i] - telegram.sent[i] for i in telegram.replied]
+        print(f'ответы:     {len(telegram.replied)}/{total}, '
+              f'полный цикл p50 {percentile(e2e, 50) * 1000:.1f} мс, p99 {percentile(e2e, 99) * 1000:.1f} мс')
+    print(f'повторы после 503: {stats["retries"]}, ошибки доставки: {stats["errors"]}, '
+          f'неверный секрет -> {stats["forbidden"]}')
+    print(f'статистика вебхука: {webhook}')
+
+
+# Данные игроков: память, отложенная запись и восстановление
+async def bench_state(args):
+    telegram = FakeTelegram()
+    await telegram.start()
+    os.environ['BOT_API_URL'] = telegram.url
+    from telegram import Update
+    from telegram.ext import ContextTypes, MessageHandler, filters
+    from game2 import GameState, QUESTION_CHARS
+    from launcher import build
+    from persistence import SqlitePersistence, deep_size
+
+    question = ('Правда ли, что ' + 'осьминоги видят поляризованный свет и ' * 20)[:QUESTION_CHARS]
+
+    async def play(update, context):
+        context.user_data.remember(f'{update.update_id} {question}', update.update_id % 2 == 0)
+
+    def application(path, idle=STATE_IDLE_NEVER):
+        persistence = SqlitePersistence(path, update_interval=3600, idle=idle)
+        app = build(TOKEN, persistence=persistence, context_types=ContextTypes(user_data=GameState))
+        app.add_handler(MessageHandler(filters.ALL, play))
+        return app, persistence
+
+    def updates(count, offset=0):
+        for i in range(count):
+            yield Update.de_json(synthetic_update(offset + i, args.users), None)
+
+    path = os.path.join(tempfile.mkdtemp(), 'state.db')
+    try:
+        app, persistence = application(path)
+        await app.initialize()
+        await persistence.start(app)
+
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        total = args.users * args.messages
+        start = time.perf_counter()
+        for update in updates(total):
+            update.set_bot(app.bot)
+            await app.process_update(update)
+        processed = time.perf_counter() - start
+        traced = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        await app.update_persistence()
+        await persistence._write()
+        written = time.perf_counter() - start
+        memory = persistence.memory()
+
+        # прежнее представление: словарь со списками строк, answers не обрезается
+        old = {
+            'answers': [i % 2 == 0 for i in range(args.messages)],
+            'history': [f'{i} {question}' for i in range(5)],
+        }
+
+        await app.shutdown()
+
+        # перезапуск: данные загружаются при первом обновлении пользователя
+        app, persistence = application(path, idle=0.0)
+        await app.initialize()
+        await persistence.start(app)
+        for update in updates(args.users, offset=total):
+            update.set_bot(app.bot)
+            await app.process_update(update)
+        restored = sum(len(data.history()) for data in app.user_data.values())
+        loaded = persistence.stats['loaded']
+        await app.update_persistence()
+        persistence._unload_idle()
+        in_memory = len(app.user_data)
+        await app.update_persistence()
+        await app.shutdown()
+        size = os.path.getsize(path)
+    finally:
+        await telegram.stop()
+
+    print(f'пользователей: {args.users}, сообщений на пользователя: {args.messages}')
+    print(f'обработка:    {total / processed:8.0f} обн./с')
+    print(f'память:       GameState {memory["per_user_avg"]} байт на пользователя (макс. {memory["per_user_max"]}), '
+          f'tracemalloc {traced // args.users} байт; прежний словарь {deep_size(old)} байт и растет с числом сообщений')
+    print(f'запись:       {args.users} пользователей за {written * 1000:.0f} мс '
+          f'({args.users / written:.0f} строк/с одной транзакцией), файл {size / 1024:.0f} КБ')
+    print(f'перезапуск:   загружено {loaded}, вопросов в истории {restored} '
+          f'(ожидалось {args.users * 5}), после выгрузки в памяти {in_memory}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный замер ботов')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    webhook = commands.add_parser('webhook', help='прием обновлений через вебхук')
+    webhook.add_argument('--updates', type=int, default=20000)
+    webhook.add_argument('--replay', help='файл JSON Lines с записанными обновлениями')
+    webhook.add_argument('--users', type=int, default=500)
+    webhook.add_argument('--rate', type=float, default=2000, help='обновлений в секунду')
+    webhook.add_argument('--connections', type=int, default=100)
+    webhook.add_argument('--port', type=int, default=8443)
+    webhook.add_argument('--queue', type=int, default=1000)
+    webhook.add_argument('--workers', type=int, default=256)
+    webhook.add_argument('--bot-connections', type=int, default=64)
+    webhook.add_argument('--delay', type=float, default=0.0, help='время обработки обновления, с')
+    webhook.add_argument('--reply', action='store_true', help='отвечать пользователю sendMessage')
+    webhook.add_argument('--timeout', type=float, default=60.0)
+
+    process = commands.add_parser('bot', help='процесс бота (запускается из webhook)')
+    process.add_argument('--delay', type=float, default=0.0)
+    process.add_argument('--reply', action='store_true')
+
+    state = commands.add_parser('state', help='данные игроков game2.py в SqlitePersistence')
+    state.add_argument('--users', type=int, default=10000)
+    state.add_argument('--messages', type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == 'bot':
+        bot(args)
+    elif args.command == 'state':
+        asyncio.run(bench_state(args))
+    else:
+        asyncio.run(bench_webhook(args))
+
+
+if __name__ == '__main__':
+    main()
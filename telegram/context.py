@@ -1,10 +1,11 @@
 # Пример работы с параметром context
 # в основном для закрепления сообщений
 # импорт модулей
-from telegram.ext import Application, ContextTypes, MessageHandler, filters
+from telegram.ext import ContextTypes, MessageHandler, filters
 from telegram import Update
 from dotenv import load_dotenv
-import time
+from launcher import build, run
+import asyncio
 import os
 
 # загружаем переменные окружения
@@ -20,7 +21,7 @@ async def text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     self_message = await context.bot.send_message(chat_id=update.message.from_user.id, text='Ваш запрос обрабатывается...')
 
     # пауза
-    time.sleep(3)
+    await asyncio.sleep(3)
    
     # сохраняем пользовательские данные
     if 'counter' not in context.user_data: context.user_data['counter'] = 0
@@ -40,15 +41,13 @@ async def text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик текстовых сообщений
     application.add_handler(MessageHandler(filters.TEXT, text))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
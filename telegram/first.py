@@ -1,8 +1,9 @@
 # Пример простейшего телеграм-бота
 
 # импорт модулей
-from telegram.ext import Application, CommandHandler
+from telegram.ext import CommandHandler
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 
 # загружаем переменные окружения
@@ -19,15 +20,13 @@ async def start(update, context):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler("start", start))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
@@ -1,11 +1,13 @@
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import CommandHandler, MessageHandler, filters
 from telegram.ext import ContextTypes, CallbackQueryHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 import requests
-import aiohttp
+from api_client import api
+from persistence import SqlitePersistence, STATE_DB
 import base64
 import json
 
@@ -15,6 +17,61 @@ load_dotenv()
 # токен бота
 TOKEN = os.getenv('TG_TOKEN')
 
+# число последних вопросов, которые помнит бот, и максимальная длина вопроса в истории
+HISTORY_SIZE = 5
+QUESTION_CHARS = 300
+
+# Данные игрока (context.user_data): последние HISTORY_SIZE вопросов и правильных
+# ответов в кольцевых буферах фиксированного размера, поэтому память на игрока
+# ограничена. Вопросы хранятся в UTF-8 (bytes): у строки str после сериализации
+# в JSON остается еще и кэш UTF-8, то есть вдвое больше памяти. Ответы - биты числа.
+class GameState:
+    __slots__ = ('count', 'answers', 'questions')
+
+    def __init__(self):
+        self.count = 0          # число заданных вопросов (позиция в кольце)
+        self.answers = 0        # правильные ответы, последний - младший бит
+        self.questions = []     # кольцо вопросов, не больше HISTORY_SIZE
+
+    # МЕТОД: запоминание заданного вопроса и правильного ответа
+    def remember(self, question: str, answer: bool):
+        question = question[:QUESTION_CHARS].encode()
+        if len(self.questions) < HISTORY_SIZE:
+            self.questions.append(question)
+        else:
+            self.questions[self.count % HISTORY_SIZE] = question
+        self.answers = ((self.answers << 1) | bool(answer)) & ((1 << HISTORY_SIZE) - 1)
+        self.count += 1
+
+    # МЕТОД: правильный ответ на последний вопрос (None, если вопросов не было)
+    def last_answer(self):
+        return bool(self.answers & 1) if self.count else None
+
+    # МЕТОД: последние вопросы, от старых к новым
+    def history(self) -> list:
+        start = self.count % len(self.questions) if self.questions else 0
+        return [question.decode() for question in self.questions[start:] + self.questions[:start]]
+
+    def reset(self):
+        self.count = 0
+        self.answers = 0
+        self.questions = []
+
+    # сохранение и загрузка для SqlitePersistence
+    def dump(self) -> dict:
+        return {
+            'count': self.count, 'answers': self.answers,
+            'questions': [question.decode() for question in self.questions],
+        }
+
+    def load(self, data: dict):
+        self.count = data['count']
+        self.answers = data['answers']
+        self.questions = [question.encode() for question in data['questions']]
+
+    def __repr__(self):
+        return f'GameState(count={self.count}, answers={self.answers:0{HISTORY_SIZE}b}, history={self.history()})'
+
 # создание клавиатуры "Продолжить"
 buttons_cont = [
     InlineKeyboardButton('Продолжить', callback_data='cont')
@@ -39,37 +96,28 @@ async def start(update, context):
 
 # функция-обработчик команды /game
 async def game(update, context):
-    user_id = update.message.from_user.id
-    
     # Очищаем историю пользователя
-    context.bot_data[user_id] = {}
-    context.bot_data[user_id]['answers'] = []
-    context.bot_data[user_id]['history'] = []
+    context.user_data.reset()
     
     # -- Выводим в консоль, чтобы видеть текущее состояние истории
-    print(f"[DEBUG] /game: История до формирования вопроса: {context.bot_data[user_id]}")
+    print(f"[DEBUG] /game: История до формирования вопроса: {context.user_data}")
     
     first_message = await update.message.reply_text('Минуту...')
     
     # формируем вопрос, передавая текущую историю
-    quest = await query_api(context.bot_data[user_id]['history'])
-    
-    # Добавляем полученный вопрос и правильный ответ в словари
-    context.bot_data[user_id]['answers'].append(quest['answer'])
-    context.bot_data[user_id]['history'].append(quest['question'])
+    quest = await query_api(context.user_data.history())
     
-    # ограничение истории до последних 5 вопросов
-    if len(context.bot_data[user_id]['history']) > 5:
-        context.bot_data[user_id]['history'] = context.bot_data[user_id]['history'][-5:]
+    # Запоминаем вопрос и правильный ответ (хранятся последние HISTORY_SIZE вопросов)
+    context.user_data.remember(quest['question'], quest['answer'])
     
     # -- Выводим в консоль, чтобы видеть состояние истории после добавления
-    print(f"[DEBUG] /game: История после формирования вопроса: {context.bot_data[user_id]}")
+    print(f"[DEBUG] /game: История после формирования вопроса: {context.user_data}")
     
     # редактируем сообщение пользователю с новым вопросом
     await first_message.edit_text(quest['question'], reply_markup=inline_menu)
 
 # Функция обращается к API с запросом
-#   history - история диалога в виде списка
+#   history - история диалога (последние вопросы)
 # Возвращает ответ от API в виде словаря {'question': str, 'answer': bool}
 async def query_api(history):
     system = 'Ты задаешь вопросы участникам чата'
@@ -83,19 +131,9 @@ async def query_api(history):
         f'Не повторяй слова из истории: {hist}.\n'
     )
 
-    param = {
-        'system': system,
-        'user': user,
-        'temperature': 0.5,
-        'format': { "type": "json_object" }
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post('http://127.0.0.1:8000/api/request', json=param) as response:
-            # получение ответа от API
-            answer = await response.json()
-            # внутри 'message' у нас лежит JSON-строка {"question": "...", "answer": ...}
-            return json.loads(answer['message'])
+    # внутри ответа лежит JSON-строка {"question": "...", "answer": ...}
+    message = await api.request(system, user, temperature=0.5, format={"type": "json_object"})
+    return json.loads(message)
 
 # функция-обработчик нажатий на кнопки
 async def button(update: Update, context):
@@ -105,7 +143,11 @@ async def button(update: Update, context):
     # обработка кнопок "Правда", "Не правда"
     if query.data in {'yes', 'no'}:
         answer_user = (query.data == 'yes')  # True, если 'yes', иначе False
-        answer_right = context.bot_data[user_id]['answers'][-1]
+        answer_right = context.user_data.last_answer()
+        if answer_right is None:
+            # вопрос был задан давно, и данные игрока уже удалены
+            await query.answer('Начните новую игру командой /game')
+            return
         message = 'Вы совершенно правы!' if answer_user == answer_right else 'Вы не угадали'
         
         await context.bot.send_message(chat_id=user_id, text=message, reply_markup=inline_cont)
@@ -115,20 +157,15 @@ async def button(update: Update, context):
     # обработка кнопки "Продолжить"
     if query.data == 'cont':
         # -- Выводим текущую историю до добавления нового вопроса
-        print(f"[DEBUG] (cont): История до формирования нового вопроса: {context.bot_data[user_id]}")
+        print(f"[DEBUG] (cont): История до формирования нового вопроса: {context.user_data}")
         
         first_message = await context.bot.send_message(chat_id=user_id, text='Минуту...')
         
-        quest = await query_api(context.bot_data[user_id]['history'])
-        context.bot_data[user_id]['answers'].append(quest['answer'])
-        context.bot_data[user_id]['history'].append(quest['question'])
-        
-        # ограничение истории
-        if len(context.bot_data[user_id]['history']) > 5:
-            context.bot_data[user_id]['history'] = context.bot_data[user_id]['history'][-5:]
+        quest = await query_api(context.user_data.history())
+        context.user_data.remember(quest['question'], quest['answer'])
         
         # -- Выводим текущую историю после формирования нового вопроса
-        print(f"[DEBUG] (cont): История после формирования нового вопроса: {context.bot_data[user_id]}")
+        print(f"[DEBUG] (cont): История после формирования нового вопроса: {context.user_data}")
 
         await first_message.edit_text(quest['question'], reply_markup=inline_menu)
         await query.answer()
@@ -136,15 +173,18 @@ async def button(update: Update, context):
 
 # функция "Запуск бота"
 def main():
-    application = Application.builder().token(TOKEN).build()
+    # данные игроков хранятся в SQLite и переживают перезапуск бота
+    application = build(
+        TOKEN,
+        persistence=SqlitePersistence(STATE_DB),
+        context_types=ContextTypes(user_data=GameState)
+    )
 
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('game', game))
     application.add_handler(CallbackQueryHandler(button))
 
-    print('Бот запущен...')
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,9 @@
 # Пример обработки различных событий
 
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import CommandHandler, MessageHandler, filters
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 
 # загружаем переменные окружения
@@ -43,7 +44,7 @@ async def voice(update, context):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler("start", start))
@@ -61,9 +62,7 @@ def main():
     application.add_handler(MessageHandler(filters.VOICE, voice))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
@@ -3,9 +3,10 @@
 # кнопки которые прикрепляются к каждому сообщению они называются inline кнопки
 
 # импорт библиотек
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+from telegram.ext import CommandHandler, CallbackQueryHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 
 # подгружаем переменные окружения
@@ -66,7 +67,7 @@ async def button(update: Update, context):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler("start", start))
@@ -75,9 +76,7 @@ def main():
     application.add_handler(CallbackQueryHandler(button))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
@@ -0,0 +1,99 @@
+# Сборка и запуск приложения бота
+#
+# Все боты создаются одинаково:
+#   - обновления обрабатываются параллельно (до CONCURRENT_UPDATES одновременно),
+#     поэтому ожидание ответа API в одном чате не задерживает остальные;
+#   - при запуске открывается общая сессия API (api_client) и стартует сторож
+#     цикла событий (watchdog), при остановке они закрываются;
+#   - данные пользователей можно хранить в SQLite (persistence.py);
+#   - обновления приходят длинным опросом (BOT_MODE=polling, по умолчанию)
+#     или через вебхук (BOT_MODE=webhook, см. webhook.py).
+#
+# Подключение в боте:
+#   from launcher import build, run
+#   application = build(TOKEN)
+#   application.add_handler(...)
+#   run(application)
+
+import asyncio
+import os
+import socket
+
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from api_client import api
+from persistence import SqlitePersistence
+from watchdog import watchdog
+from webhook import run_webhook
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Число обновлений, которые обрабатываются одновременно
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '256'))
+# Размер пула соединений бота к Bot API (ответы пользователям при параллельной обработке)
+BOT_CONNECTIONS = int(os.getenv('BOT_CONNECTIONS', '64'))
+# Заголовки и тело запроса к Bot API httpx отправляет разными пакетами: без
+# TCP_NODELAY второй пакет ждет подтверждения первого (до 40 мс на запрос)
+BOT_SOCKET_OPTIONS = ((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),)
+# Адрес Bot API (например, собственный сервер telegram-bot-api)
+BOT_API_URL = os.getenv('BOT_API_URL', 'https://api.telegram.org/bot')
+
+
+# Запросы к Bot API с ограничением числа одновременных запросов размером пула.
+# Пул httpcore при каждом освобождении соединения перебирает всю очередь ожидающих
+# запросов, и сотни параллельных обработчиков, ждущих соединения в пуле, нагружают
+# цикл событий сильнее самих запросов. Семафор держит эту очередь пустой.
+class BotRequest(HTTPXRequest):
+    def __init__(self, connection_pool_size: int = BOT_CONNECTIONS, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, socket_options=BOT_SOCKET_OPTIONS, **kwargs)
+        self.slots = asyncio.Semaphore(connection_pool_size)
+
+    async def do_request(self, *args, **kwargs):
+        async with self.slots:
+            return await super().do_request(*args, **kwargs)
+
+
+async def post_init(application: Application):
+    await api.start()
+    await watchdog.start()
+    if isinstance(application.persistence, SqlitePersistence):
+        await application.persistence.start(application)
+
+
+async def post_shutdown(application: Application):
+    await watchdog.stop()
+    await api.close()
+
+
+# ФУНКЦИЯ: создание приложения бота
+#   token         - токен бота
+#   persistence   - хранилище данных пользователей (например, SqlitePersistence)
+#   context_types - типы данных контекста (например, запись user_data со __slots__)
+def build(token: str, persistence=None, context_types=None) -> Application:
+    builder = (
+        Application.builder()
+        .token(token)
+        .base_url(BOT_API_URL)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .request(BotRequest())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if persistence is not None:
+        builder.persistence(persistence)
+    if context_types is not None:
+        builder.context_types(context_types)
+    return builder.build()
+
+
+# ФУНКЦИЯ: запуск бота (нажать Ctrl-C для остановки бота)
+def run(application: Application):
+    if BOT_MODE not in ('polling', 'webhook'):
+        raise ValueError(f'Неизвестный режим BOT_MODE={BOT_MODE!r}, допустимы: polling, webhook')
+    print('Бот запущен...')
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
+    print('Бот остановлен')
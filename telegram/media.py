@@ -1,9 +1,10 @@
 # Пример работы с медиа-файлами
 
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import CommandHandler, MessageHandler, filters
 from telegram import Update
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 
 # подгружаем переменные окружения
@@ -71,8 +72,7 @@ async def voice(update: Update, _):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
-    print('Бот запущен...')
+    application = build(TOKEN)
 
     # добавляем обработчик сообщений с фотографиями
     application.add_handler(MessageHandler(filters.PHOTO, image))
@@ -84,8 +84,7 @@ def main():
     application.add_handler(CommandHandler("start", start))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
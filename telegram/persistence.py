@@ -0,0 +1,291 @@
+# Хранение данных пользователей бота в SQLite (BasePersistence)
+#
+# Данные пользователя (context.user_data) - компактная запись: класс со __slots__
+# и кольцевыми буферами фиксированного размера, так что память на одного
+# пользователя ограничена. Запись умеет сохранять себя в простые типы (dump)
+# и загружаться обратно (load); обычный dict тоже поддерживается.
+#
+# Как работает:
+#   - при запуске в память ничего не читается; данные пользователя загружаются
+#     из SQLite при первом его обновлении (refresh_user_data);
+#   - python-telegram-bot раз в update_interval передает измененные записи
+#     (update_user_data); они копятся в буфере и пишутся в SQLite пачкой
+#     в одной транзакции (отложенная запись);
+#   - пользователи без обновлений дольше STATE_IDLE выгружаются из памяти
+#     (остаются в SQLite), а не заходившие дольше STATE_TTL удаляются из SQLite.
+#
+# Подключение в боте:
+#   persistence = SqlitePersistence(STATE_DB)
+#   application = build(TOKEN, persistence=persistence, context_types=ContextTypes(user_data=GameState))
+
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+import orjson
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+# Файл SQLite с данными пользователей
+STATE_DB = os.getenv('STATE_DB', 'bot_state.db')
+# Как часто python-telegram-bot передает измененные данные, с
+STATE_UPDATE_INTERVAL = float(os.getenv('STATE_UPDATE_INTERVAL', '5'))
+# Период записи буфера в SQLite и выгрузки неактивных пользователей, с
+STATE_FLUSH = float(os.getenv('STATE_FLUSH', '5'))
+# Размер буфера, при котором он пишется, не дожидаясь периода
+STATE_BATCH = int(os.getenv('STATE_BATCH', '500'))
+# Через сколько секунд без обновлений пользователь выгружается из памяти
+STATE_IDLE = float(os.getenv('STATE_IDLE', '3600'))
+# Через сколько секунд без обновлений данные пользователя удаляются совсем (30 дней)
+STATE_TTL = float(os.getenv('STATE_TTL', str(30 * 24 * 3600)))
+
+
+# ФУНКЦИЯ: размер объекта в памяти вместе с вложенными объектами, байт
+def deep_size(obj, seen: set = None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    for name in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, name):
+            size += deep_size(getattr(obj, name), seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+def _dump(data) -> bytes:
+    return orjson.dumps(data.dump() if hasattr(data, 'dump') else data)
+
+
+def _load(data, blob: bytes):
+    value = orjson.loads(blob)
+    if hasattr(data, 'load'):
+        data.load(value)
+    else:
+        data.update(value)
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self, path: str = STATE_DB, update_interval: float = STATE_UPDATE_INTERVAL,
+                 idle: float = STATE_IDLE, ttl: float = STATE_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.idle = idle
+        self.ttl = ttl
+        self.application = None
+        self.task = None
+        # пользователи в памяти -> время последнего обновления, старые первыми
+        self.seen = OrderedDict()
+        # записи, ожидающие записи в SQLite: пользователь -> (данные, время)
+        self.pending = {}
+        # выгруженные пользователи, чье удаление из памяти не должно удалять их из SQLite
+        self.unloaded = set()
+        # загрузки из SQLite в процессе: пользователь -> future, который ждут
+        # параллельные обновления того же пользователя
+        self.loading = {}
+        self.swept = 0.0
+        self.stats = {'loaded': 0, 'written': 0, 'batches': 0, 'unloaded': 0, 'expired': 0}
+
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS user_data (user INTEGER PRIMARY KEY, data BLOB, seen REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS user_data_seen ON user_data (seen)')
+
+    # ---------- жизненный цикл ----------
+
+    # МЕТОД: запуск периодической записи и выгрузки (вызывается из post_init)
+    async def start(self, application: Application):
+        self.application = application
+        if self.task is None:
+            self.task = asyncio.create_task(self._sweeper())
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH)
+            try:
+                await self._write()
+                self._unload_idle()
+                await self._expire()
+            except Exception as e:
+                print(f'Ошибка записи данных пользователей: {e}')
+
+    # запись буфера в SQLite одной транзакцией
+    async def _write(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        rows = [(user, data, seen) for user, (data, seen) in batch.items()]
+
+        def write():
+            with self.lock:
+                with self.db:
+                    self.db.execute('BEGIN')
+                    self.db.executemany('INSERT OR REPLACE INTO user_data (user, data, seen) VALUES (?, ?, ?)', rows)
+        try:
+            await asyncio.to_thread(write)
+        except BaseException:
+            # не записанное возвращается в буфер (более новые данные не затираются)
+            for user, value in batch.items():
+                self.pending.setdefault(user, value)
+            raise
+        self.stats['written'] += len(rows)
+        self.stats['batches'] += 1
+
+    # выгрузка из памяти пользователей без обновлений дольше idle
+    def _unload_idle(self):
+        deadline = time.time() - self.idle
+        while self.seen:
+            user, seen = next(iter(self.seen.items()))
+            if seen >= deadline:
+                break
+            del self.seen[user]
+            self.unloaded.add(user)
+            self.application.drop_user_data(user)
+            self.stats['unloaded'] += 1
+
+    # удаление из SQLite пользователей, не заходивших дольше ttl (раз в час)
+    async def _expire(self):
+        now = time.time()
+        if now - self.swept < min(self.ttl, 3600):
+            return
+        self.swept = now
+
+        def expire():
+            with self.lock:
+                return self.db.execute('DELETE FROM user_data WHERE seen < ?', (now - self.ttl,)).rowcount
+        self.stats['expired'] += await asyncio.to_thread(expire)
+
+    # МЕТОД: память, занятая данными пользователей
+    def memory(self) -> dict:
+        if self.application is None:
+            return {'users': len(self.seen)}
+        sizes = [deep_size(data) for data in self.application.user_data.values()]
+        return {
+            'users': len(sizes),
+            'bytes': sum(sizes),
+            'per_user_avg': round(sum(sizes) / len(sizes)) if sizes else 0,
+            'per_user_max': max(sizes, default=0),
+            'pending': len(self.pending),
+        }
+
+    # ---------- данные пользователей ----------
+
+    async def get_user_data(self) -> dict:
+        # данные загружаются по мере обращения пользователей (refresh_user_data)
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data):
+        # параллельное обновление того же пользователя ждет окончания загрузки:
+        # иначе обработчик увидит пустые данные, а загрузка затрет его изменения
+        while user_id in self.loading:
+            await asyncio.shield(self.loading[user_id])
+        now = time.time()
+        if user_id in self.seen:
+            self.seen.move_to_end(user_id)
+            self.seen[user_id] = now
+            return
+
+        loaded = asyncio.get_running_loop().create_future()
+        self.loading[user_id] = loaded
+        try:
+            if user_id in self.pending:
+                blob = self.pending[user_id][0]
+            else:
+                def read():
+                    with self.lock:
+                        return self.db.execute('SELECT data FROM user_data WHERE user = ?', (user_id,)).fetchone()
+                row = await asyncio.to_thread(read)
+                blob = row[0] if row else None
+            if blob is not None:
+                _load(user_data, blob)
+                self.stats['loaded'] += 1
+            # пользователь считается загруженным только после чтения
+            self.seen[user_id] = now
+        finally:
+            # при ошибке ожидающие повторят загрузку сами
+            del self.loading[user_id]
+            loaded.set_result(None)
+
+    async def update_user_data(self, user_id: int, data):
+        self.pending[user_id] = (_dump(data), self.seen.get(user_id, time.time()))
+        if len(self.pending) >= STATE_BATCH:
+            await self._write()
+
+    async def drop_user_data(self, user_id: int):
+        if user_id in self.unloaded:
+            # выгрузка из памяти, а не удаление; если пользователь успел вернуться,
+            # его изменения нужно записать (python-telegram-bot пропустил их из-за удаления)
+            self.unloaded.discard(user_id)
+            if user_id in self.seen:
+                self.application.mark_data_for_update_persistence(user_ids=user_id)
+            return
+        self.seen.pop(user_id, None)
+        self.pending.pop(user_id, None)
+
+        def drop():
+            with self.lock:
+                self.db.execute('DELETE FROM user_data WHERE user = ?', (user_id,))
+        await asyncio.to_thread(drop)
+
+    # МЕТОД: запись буфера и закрытие базы при остановке бота
+    async def flush(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self._write()
+        with self.lock:
+            self.db.close()
+
+    # ---------- остальные данные не хранятся ----------
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,156 @@
+# Ограничение числа обращений пользователя к боту
+#
+# Скользящее окно по журналу: для пользователя хранятся времена последних
+# limit обращений. Новое обращение разрешено, если их меньше limit или самое
+# старое было раньше, чем window секунд назад. Журнал ограничен limit записями,
+# поэтому проверка - O(1), а окно не сбрасывается рывком раз в минуту
+# и не пропускает двойную порцию на границе.
+#
+# Состояние вычисляется при обращении, периодического сброса нет. Пользователь,
+# у которого последнее обращение старше окна, ничем не отличается от нового,
+# и его запись удаляется: в памяти - из начала OrderedDict (порядок последнего
+# доступа), в SQLite - раз в окно одним DELETE.
+#
+# Состояние хранится в памяти процесса или, если задан путь к файлу,
+# в SQLite - тогда лимиты общие для всех процессов бота на машине.
+
+import asyncio
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Лимит обращений и длина окна, с
+RATE_LIMIT = int(os.getenv('RATE_LIMIT', '3'))
+RATE_WINDOW = float(os.getenv('RATE_WINDOW', '60'))
+# Файл SQLite для общих лимитов нескольких процессов (пусто - в памяти)
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '')
+
+
+class RateLimiter:
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW, path: str = None):
+        self.limit = limit
+        self.window = window
+        self.path = path
+        # пользователь -> времена последних обращений, в порядке последнего доступа
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        self.swept = 0.0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS ratelimit (user TEXT PRIMARY KEY, stamps BLOB, last REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS ratelimit_last ON ratelimit (last)')
+
+        # счетчики
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    # ---------- хранение состояния ----------
+
+    # Выполняет change(stamps, now) атомарно для одного пользователя: в памяти -
+    # под блокировкой потока, в файле - в транзакции BEGIN IMMEDIATE
+    def _transact(self, user, change):
+        now = time.time()
+        with self.lock:
+            if self.db is None:
+                stamps = self.users.pop(user, None) or deque(maxlen=self.limit)
+                result = change(stamps, now)
+                if stamps and now - stamps[-1] < self.window:
+                    self.users[user] = stamps
+                self._evict(now)
+                return result
+
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT stamps FROM ratelimit WHERE user = ?', (str(user),)).fetchone()
+                stamps = deque(self._unpack(row[0]) if row else (), maxlen=self.limit)
+                result = change(stamps, now)
+                if stamps and now - stamps[-1] < self.window:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO ratelimit (user, stamps, last) VALUES (?, ?, ?)',
+                        (str(user), self._pack(stamps), stamps[-1])
+                    )
+                elif row:
+                    self.db.execute('DELETE FROM ratelimit WHERE user = ?', (str(user),))
+                if now - self.swept >= self.window:
+                    self.evicted += self.db.execute(
+                        'DELETE FROM ratelimit WHERE last < ?', (now - self.window,)
+                    ).rowcount
+                    self.swept = now
+                self.db.execute('COMMIT')
+                return result
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    # удаление пользователей, чье последнее обращение старше окна
+    def _evict(self, now: float):
+        while self.users:
+            user, stamps = next(iter(self.users.items()))
+            if now - stamps[-1] < self.window:
+                break
+            del self.users[user]
+            self.evicted += 1
+
+    @staticmethod
+    def _pack(stamps) -> bytes:
+        return struct.pack(f'{len(stamps)}d', *stamps)
+
+    @staticmethod
+    def _unpack(data: bytes) -> tuple:
+        return struct.unpack(f'{len(data) // 8}d', data)
+
+    async def _call(self, user, change):
+        if self.db is None:
+            return self._transact(user, change)
+        return await asyncio.to_thread(self._transact, user, change)
+
+    # ---------- логика окна ----------
+
+    # МЕТОД: попытка обращения пользователя
+    # Возвращает 0, если обращение разрешено (и учтено), иначе через сколько секунд можно повторить
+    async def take(self, user) -> float:
+        def change(stamps, now):
+            if len(stamps) == self.limit and now - stamps[0] < self.window:
+                self.rejected += 1
+                return stamps[0] + self.window - now
+            stamps.append(now)
+            self.allowed += 1
+            return 0.0
+        return await self._call(user, change)
+
+    # МЕТОД: возврат последнего обращения (например, если запрос к API не удался)
+    async def give_back(self, user):
+        def change(stamps, now):
+            if stamps:
+                stamps.pop()
+        await self._call(user, change)
+
+    # МЕТОД: сколько обращений осталось в текущем окне
+    async def remaining(self, user) -> int:
+        def change(stamps, now):
+            return self.limit - sum(1 for stamp in stamps if now - stamp < self.window)
+        return await self._call(user, change)
+
+    def stats(self) -> dict:
+        if self.db is None:
+            users = len(self.users)
+        else:
+            with self.lock:
+                users = self.db.execute('SELECT COUNT(*) FROM ratelimit').fetchone()[0]
+        return {
+            'users': users, 'allowed': self.allowed,
+            'rejected': self.rejected, 'evicted': self.evicted,
+        }
+
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+            self.db = None
@@ -1,9 +1,10 @@
 # Пример создания reply-клавиатуры
 #общая клавиатура которая распологается внизу называется reply
 # импорт модулей
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+from telegram.ext import CommandHandler, CallbackQueryHandler
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from dotenv import load_dotenv
+from launcher import build, run
 import os
 
 # подгружаем переменные окружения
@@ -61,7 +62,7 @@ async def button(update: Update, _):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /city
     application.add_handler(CommandHandler('city', city))
@@ -70,9 +71,7 @@ def main():
     application.add_handler(CommandHandler('hidden', hidden))    
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
@@ -1,10 +1,15 @@
 # Пример синхронного обращения к API
+# Синхронный requests.post блокирует цикл событий, поэтому вызов выполняется
+# в отдельном потоке (asyncio.to_thread), а обработчик ждет его результата
 
 # импорт модулей
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import CommandHandler, MessageHandler, filters
 from dotenv import load_dotenv
+from launcher import build, run
+import asyncio
 import os
 import requests
+from api_client import API_URL, API_TIMEOUT
 
 # загружаем переменные окружения
 load_dotenv()
@@ -25,7 +30,9 @@ async def text(update, context):
     param = {
         'text': update.message.text
     }    
-    response = requests.post('http://127.0.0.1:8000/api/get_answer', json = param)
+    response = await asyncio.to_thread(
+        requests.post, f'{API_URL}/api/get_answer_async', json = param, timeout = API_TIMEOUT
+    )
     answer = response.json()
 
     # ответ пользователю
@@ -36,7 +43,7 @@ async def text(update, context):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик команды /start
     application.add_handler(CommandHandler("start", start))
@@ -45,9 +52,7 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT, text))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
@@ -7,11 +7,12 @@
 #Как работать с объектом Update, чтобы получить данные о сообщении, пользователе и контексте.
 
 # импорт библиотек
-from telegram.ext import Application, MessageHandler, filters
+from telegram.ext import MessageHandler, filters
 from telegram import Update
 from pprint import pprint
 from dotenv import load_dotenv
-import time
+from launcher import build, run
+import asyncio
 import os
 
 # загружаем переменные окружения
@@ -48,7 +49,7 @@ async def text(update: Update, context):
     reply_message = await update.message.reply_text('Ваш запрос обрабатывается...')
     
     # задержка 3 секунды
-    time.sleep(3)
+    await asyncio.sleep(3)
     
     # пример редактирования первоначального сообщения
     await reply_message.edit_text('Обработка завершена')
@@ -58,15 +59,13 @@ async def text(update: Update, context):
 def main():
 
     # создаем приложение и передаем в него токен
-    application = Application.builder().token(TOKEN).build()
+    application = build(TOKEN)
 
     # добавляем обработчик текстовых сообщений
     application.add_handler(MessageHandler(filters.TEXT, text))
 
     # запускаем бота (нажать Ctrl-C для остановки бота)
-    print('Бот запущен...')    
-    application.run_polling()
-    print('Бот остановлен')
+    run(application)
 
 # проверяем режим запуска модуля
 if __name__ == "__main__":      # если модуль запущен как основная программа
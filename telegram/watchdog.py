@@ -0,0 +1,97 @@
+# Сторож цикла событий бота
+#
+# Обработчики всех чатов выполняются в одном цикле событий asyncio. Любой
+# блокирующий вызов внутри обработчика (time.sleep, requests.post, чтение
+# большого файла) останавливает обработку обновлений во всех чатах.
+#
+# Сторож состоит из двух частей:
+#   - задача в цикле событий каждые WATCHDOG_INTERVAL секунд отмечает время;
+#   - отдельный поток проверяет отметку и, если цикл не отвечает дольше
+#     WATCHDOG_THRESHOLD секунд, печатает стек потока цикла - по нему видно,
+#     какой обработчик и на какой строке заблокировал цикл.
+# Когда цикл освобождается, печатается общее время блокировки.
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Период отметок и порог блокировки цикла, с
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '0.1'))
+WATCHDOG_THRESHOLD = float(os.getenv('WATCHDOG_THRESHOLD', '0.5'))
+# Число последних кадров стека в сообщении
+WATCHDOG_STACK = 8
+# Кадры самого asyncio в стек не выводятся
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD, interval: float = WATCHDOG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.beat = time.monotonic()
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.loop_thread = None
+        # время начала текущей блокировки, о которой уже сообщено
+        self.blocked_since = None
+        self.stats = {'blocks': 0, 'max_lag': 0.0}
+
+    # МЕТОД: запуск сторожа в текущем цикле событий
+    async def start(self):
+        if self.task is not None:
+            return
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.stopped.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.thread.join()
+
+    # задача цикла событий: отметка времени и учет задержек
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - self.beat - self.interval
+            self.beat = now
+            if lag > self.threshold:
+                self.stats['blocks'] += 1
+                self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+                print(f'[watchdog] цикл событий был заблокирован {lag:.2f} с')
+            self.blocked_since = None
+
+    # поток сторожа: стек цикла, пока он заблокирован
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            beat = self.beat
+            lag = time.monotonic() - beat - self.interval
+            if lag <= self.threshold or self.blocked_since == beat:
+                continue
+            self.blocked_since = beat
+            frame = sys._current_frames().get(self.loop_thread)
+            frames = [
+                entry for entry in traceback.extract_stack(frame)
+                if not entry.filename.startswith(ASYNCIO_DIR)
+            ] if frame else []
+            stack = ''.join(traceback.format_list(frames[-WATCHDOG_STACK:]))
+            print(f'[watchdog] цикл событий не отвечает {lag:.2f} с, стек:\n{stack}', end='')
+
+
+# Сторож процесса бота
+watchdog = LoopWatchdog()
@@ -0,0 +1,149 @@
+# Прием обновлений через вебхук
+#
+# Вместо длинного опроса getUpdates Telegram сам отправляет обновления POST-запросом
+# на адрес бота. Прием устроен так:
+#   - ASGI-приложение (Starlette + uvicorn) принимает запрос и сверяет секрет
+#     из заголовка X-Telegram-Bot-Api-Secret-Token;
+#   - тело обновления без разбора кладется в ограниченную очередь, и Telegram
+#     сразу получает ответ 200;
+#   - WEBHOOK_WORKERS обработчиков забирают обновления из очереди и передают
+#     их приложению бота (application.process_update).
+# Если очередь заполнена, ответ - 503 с Retry-After: Telegram повторит доставку
+# позже, а память процесса не растет вместе с нагрузкой.
+#
+# Собственная очередь нужна потому, что application.update_queue python-telegram-bot
+# не дает обратного давления: при параллельной обработке для каждого обновления
+# сразу создается задача, и очередь никогда не заполняется.
+
+import asyncio
+import os
+import secrets
+from urllib.parse import urlsplit
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application
+
+# Публичный адрес вебхука, который регистрируется в Telegram (https://example.com/telegram)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Адрес и порт локального сервера (обычно за обратным прокси с TLS)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Секрет вебхука; если не задан, создается случайный при каждом запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Размер очереди обновлений и число обработчиков
+WEBHOOK_QUEUE = int(os.getenv('WEBHOOK_QUEUE', '1000'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '256'))
+# Число одновременных соединений Telegram к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100'))
+# Через сколько секунд Telegram повторит доставку при заполненной очереди
+WEBHOOK_RETRY_AFTER = 1
+# Время на обработку оставшихся обновлений при остановке, с
+WEBHOOK_DRAIN_TIMEOUT = 10.0
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookIngress:
+    def __init__(self, application: Application, secret: str, path: str = '/',
+                 queue_size: int = WEBHOOK_QUEUE, workers: int = WEBHOOK_WORKERS):
+        self.application = application
+        self.secret = secret.encode()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.tasks = []
+        self.stats = {'received': 0, 'rejected': 0, 'forbidden': 0, 'processed': 0, 'errors': 0}
+        self.app = Starlette(routes=[
+            Route(path, self.receive, methods=['POST']),
+            Route('/healthz', self.health, methods=['GET']),
+        ])
+
+    # МЕТОД: прием обновления от Telegram
+    async def receive(self, request: Request) -> Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), self.secret):
+            self.stats['forbidden'] += 1
+            return Response(status_code=403)
+        try:
+            data = orjson.loads(await request.body())
+        except orjson.JSONDecodeError:
+            return Response(status_code=400)
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return Response(status_code=503, headers={'Retry-After': str(WEBHOOK_RETRY_AFTER)})
+        self.stats['received'] += 1
+        return Response(status_code=200)
+
+    async def health(self, request: Request) -> Response:
+        return JSONResponse({**self.stats, 'queued': self.queue.qsize()})
+
+    # обработчик очереди: разбор обновления и передача приложению бота
+    async def _worker(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                await self.application.process_update(Update.de_json(data, self.application.bot))
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f'Ошибка обработки обновления {data.get("update_id")}: {e}')
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # МЕТОД: остановка обработчиков после обработки принятых обновлений
+    async def stop(self):
+        try:
+            await asyncio.wait_for(self.queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f'Не обработано обновлений: {self.queue.qsize()}')
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    # МЕТОД: HTTP-сервер вебхука (до Ctrl-C или SIGTERM)
+    async def serve(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        config = uvicorn.Config(self.app, host=host, port=port, log_level='warning', access_log=False)
+        await uvicorn.Server(config).serve()
+
+
+# ФУНКЦИЯ: запуск бота в режиме вебхука
+# Повторяет жизненный цикл run_polling: initialize, post_init, start,
+# затем stop, post_stop, shutdown, post_shutdown
+async def run_webhook(application: Application, url: str = WEBHOOK_URL,
+                      host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+    if not url:
+        raise RuntimeError('Для режима вебхука задайте WEBHOOK_URL')
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    ingress = WebhookIngress(application, secret, urlsplit(url).path or '/')
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url, secret_token=secret, allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        await application.start()
+        await ingress.start()
+        try:
+            await ingress.serve(host, port)
+        finally:
+            await ingress.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)